@@ -7,11 +7,16 @@ import sys
 import inspect
 import getpass
 import json
+import threading
+import time
+import itertools
 import pandas as pd
 from pprint import pprint as pp
 from app.Wing_importer import Wing
 from app.mapImportLogger import logger
-from app.xiq_exporter import XIQ
+from app.xiq_exporter import XIQ, ASSIGN_BATCH_SIZE
+from app.locationIndex import LocationIndex
+from app.locationPlanner import LocationPlan, CreateOperation, CREATE_WORKERS
 
 current_dir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
 logger = logging.getLogger('MapImporter.Main')
@@ -19,16 +24,27 @@ logger = logging.getLogger('MapImporter.Main')
 geoApiKey = ''
 XIQ_API_token = ''
 
-pageSize = '100'
-
 parser = argparse.ArgumentParser()
 parser.add_argument('--external',action="store_true", help="Optional - adds External Account selection, to create floorplans and APs on external VIQ")
 parser.add_argument('--noaplog',action="store_true", help="Optional - removes logs for APs that don't have a floor assigned")
 parser.add_argument('--nogeolog',action="store_true", help="Optional - removes logs for no GEO API key when creating locations")
+parser.add_argument('--georate',type=float, default=5, help="Optional - maximum reverse geo coordinate API requests per second")
+parser.add_argument('--workers',type=int, default=1, help="Optional - number of processes used to parse the rf-domain and AP config blocks of the tech dump")
+parser.add_argument('--treewalk',action="store_true", help="Optional - collects the XIQ location tree level by level with parallel requests instead of in one request, for very large tenants")
+parser.add_argument('--createworkers',type=int, default=CREATE_WORKERS, help="Optional - number of locations created in XIQ at the same time")
+parser.add_argument('--batchsize',type=int, default=ASSIGN_BATCH_SIZE, help="Optional - maximum number of devices sent in one request when assigning devices to their floors")
+parser.add_argument('--targeted',action="store_true", help="Optional - only looks up the XIQ devices whose MAC addresses are in the tech dump instead of collecting every device without a location")
+parser.add_argument('--pagesize',type=int, default=100, help="Optional - number of items requested per page when collecting sites, buildings, floors, devices and CCGs from XIQ")
 args = parser.parse_args()
 
+pageSize = args.pagesize
+
 PATH = current_dir
 
+# creation threads take turns asking for new names
+prompt_lock = threading.Lock()
+site_update_lock = threading.Lock()
+
 # Git Shell Coloring - https://gist.github.com/vratiu/9780109
 RED   = "\033[1;31m"  
 BLUE  = "\033[1;34m"
@@ -53,17 +69,13 @@ def yesNoLoop(question):
             raise SystemExit
     return response
 
-def updateApWithId(ap):
-    global wing_ap_df
-    filt = wing_ap_df['mac'] == ap['mac_address']
-    wing_ap_df.loc[filt,'xiq_id'] = ap['id']
-
 def checkNameLength(name, type):
     while len(name) > 32:
-        sys.stdout.write(YELLOW)
-        sys.stdout.write(f"'{name}' is longer than 32 characters allowed for a name.\n")
-        sys.stdout.write(RESET)
-        name = input(f"Please enter a new name for the {type} that is less than 32 characters: ")
+        with prompt_lock:
+            sys.stdout.write(YELLOW)
+            sys.stdout.write(f"'{name}' is longer than 32 characters allowed for a name.\n")
+            sys.stdout.write(RESET)
+            name = input(f"Please enter a new name for the {type} that is less than 32 characters: ")
     return name
 
 def createSiteLoop(parent_id, site_name, country_code):
@@ -74,33 +86,18 @@ def createSiteLoop(parent_id, site_name, country_code):
                 "name": site_name,
                 "country_code": country_code
                 }
-        site_added = False
         new_site = x.createSite(site_name,data)
         if new_site != 'Duplicate_Name':
             site_id = new_site['id']
-            for location in global_location_dic:
-                if location['id'] == parent_id:
-                    location['children'].append(new_site)
-                    logger.info(f"Updated global_location_dic {location['name']} with child Site {new_site['name']}")
-                    site_added = True
-                    break
-                else:
-                    for child in location['children']:
-                        if child['id'] == parent_id:
-                            child['children'].append(new_site)
-                            logger.info(f"Updated global_location_dic {child['name']} with child Site {new_site['name']}")
-                            site_added = True
-                            break
-                    if site_added:
-                        break
+            location_index.add(new_site, type='SITE', parent_id=parent_id)
+            logger.info(f"Updated location index with child Site {new_site['name']}")
             valid_site = True
         else:
-            print(f"{site_name} already exists. XIQ requires a unique name.")
-            site_name = input(f"Please enter a name for the site: ")
+            with prompt_lock:
+                print(f"{site_name} already exists. XIQ requires a unique name.")
+                site_name = input(f"Please enter a name for the site: ")
     log_msg = f"Site {site_name} was created successfully."
-    sys.stdout.write(GREEN)
-    sys.stdout.write(log_msg + "\n\n")
-    sys.stdout.write(RESET)
+    sys.stdout.write(GREEN + log_msg + "\n\n" + RESET)
     sys.stdout.flush()
     logger.info(log_msg)
     return site_id
@@ -114,88 +111,331 @@ def createLocLoop(parent_id, loc_name):
         new_loc = x.createLocation(loc_name,data)
         if new_loc != 'Duplicate_Name':
             loc_id = new_loc['id']
-            for location in global_location_dic:
-                if location['id'] == parent_id:
-                    if new_loc['type'] == 'Site Group':
-                        new_loc['type'] = 'Site_Group'
-                        logger.info(f"Changing type of {new_loc['name']} to match location tree - 'Site_Group'")
-                    location['children'].append(new_loc)
-                    logger.info(f"Updated global_location_dic with Site_Group {new_loc['name']}")
+            if new_loc['type'] == 'Site Group':
+                new_loc['type'] = 'Site_Group'
+                logger.info(f"Changing type of {new_loc['name']} to match location tree - 'Site_Group'")
+            location_index.add(new_loc, parent_id=parent_id)
+            logger.info(f"Updated location index with Site_Group {new_loc['name']}")
             valid_loc = True
         else:
-            print(f"{loc_name} already exists. XIQ requires a unique name.")
-            loc_name = input(f"Please enter a name for the Site Group: ")
+            with prompt_lock:
+                print(f"{loc_name} already exists. XIQ requires a unique name.")
+                loc_name = input(f"Please enter a name for the Site Group: ")
     log_msg = f"Site Group {loc_name} was created successfully."
-    sys.stdout.write(GREEN)
-    sys.stdout.write(log_msg + "\n\n")
-    sys.stdout.write(RESET)
+    sys.stdout.write(GREEN + log_msg + "\n\n" + RESET)
     sys.stdout.flush()
     logger.info(log_msg)
     return loc_id
 
-def locationCreationLoop(location_tree, country_code):
+def planHierarchy(plan, location_tree, country_code):
+    # plans the site groups and site of a building that are not in XIQ yet.
+    # Returns the id of the site, or the operation that will create it
+    global_site_id = global_location_dic[0]['id']
+    site_name = location_tree[-1]
     if len(location_tree) == 1:
-        if not any(d['name'] == location_tree[0] for d in global_location_dic[0]['children']):
-            global_site_id = global_location_dic[0]['id']
-            site_name = location_tree[0]
-            site_id = createSiteLoop(global_site_id, site_name, country_code)
-            return site_id
+        location = location_index.findChild(global_site_id, location_tree[0])
+        if location is None:
+            parent = global_site_id
+        elif location['type'] != 'SITE':
+            print(f"{location_tree[0]} already exists as a {location['type']}. XIQ requires a building to be part of a site. ")
+            site_name = input(f"Please enter a new name for the site: ")
+            parent = location['id']
         else:
-            for location in global_location_dic[0]['children']:
-                if location['name'] == location_tree[0]:
-                    if location['type'] != 'SITE':
-                        print(f"{location_tree[0]} already exists as a {location['type']}. XIQ requires a building to be part of a site. ")
-                        site_name = input(f"Please enter a new name for the site: ")
-                        site_group_id = location['id']
-                        site_id = createSiteLoop(site_group_id, site_name, country_code)
-                        return site_id
-                    else:
-                        site_id = location['id']
-                        print(f"found site {location['name']} - {site_id}")
-                        return site_id
+            site_id = location['id']
+            print(f"found site {location['name']} - {site_id}")
+            return site_id
+    else:
+        parent = global_site_id
+        for loc_name in location_tree[:-1]:
+            parent_dir = None
+            if not isinstance(parent, CreateOperation):
+                parent_dir = location_index.findChild(parent, loc_name)
+            if parent_dir is not None and parent_dir['type'] == "Site_Group":
+                print(f"Location {parent_dir['name']} was found in XIQ.")
+                parent = parent_dir['id']
+                continue
+            if parent_dir is not None:
+                print(f"{parent_dir['name']} already exists, but it is not a Site Group!")
+            parent_key = parent.key if isinstance(parent, CreateOperation) else parent
+            parent = plan.add(('Site_Group', parent_key, loc_name), 'Site Group', loc_name, parent,
+                              lambda parent_id, loc_name=loc_name: createLocLoop(parent_id, loc_name))
+    return plan.add(('SITE', location_tree[-1]), 'Site', site_name, parent,
+                    lambda parent_id, site_name=site_name: createSiteLoop(parent_id, site_name, country_code))
+
+def planSite(plan, building):
+    site_name = building['location_tree'][-1]
+    planned_site = plan.get(('SITE', site_name))
+    if planned_site is not None:
+        return planned_site
+    xiq_site_exist, xiq_site_update, site_id = location_index.checkSite(site_name)
+    if not xiq_site_exist:
+        return planHierarchy(plan, building['location_tree'], building['country_code'])
+    if xiq_site_update:
+        # XIQ requires the country code, so the buildings wait for the update
+        return plan.add(('SITE_UPDATE', site_name), 'Site update', site_name, site_id,
+                        lambda parent_id, country_code=building['country_code']: updateSiteCountry(site_name, country_code))
+    return site_id
+
+def planLocationCreation():
+    # turns rawData into a plan of the site groups, sites, buildings and floors to create
+    plan = LocationPlan()
+    buildings_with_floors = {floor['associated_building_id'] for floor in rawData['floors']}
+    building_parents = {}
+    for building in rawData['building']:
+        if building['building_id'] not in buildings_with_floors:
+            log_msg = (f"no floors were found for building {building['name']}. Skipping creation of building")
+            logger.info(log_msg)
+            continue
+        # Check if building exists
+        existing_buildings = location_index.findByName(building['name'], type='BUILDING')
+        if existing_buildings:
+            building['xiq_building_id'] = str(existing_buildings[0]['id'])
+            building_parents[building['building_id']] = (building['name'], existing_buildings[0]['id'])
+            # just log that the building already exists
+            log_msg = (f"Building {building['name']} already exists! The Script will attempt to add Floors and APs to this building")
+            logger.critical(log_msg)
+            continue
+        site = planSite(plan, building)
+        operation = plan.add(('BUILDING', building['building_id']), 'Building', building['name'], site,
+                             lambda parent_id, building=building: createBuilding(building, parent_id))
+        building_parents[building['building_id']] = (building['name'], operation)
+
+    same_floors = {}
+    for floor in rawData['floors']:
+        if floor['associated_building_id'] == None:
+            log_msg = f"Floor '{floor['name']}' is not associated with the buildings in Wing so it will be skipped."
+            logger.warning(log_msg)
+            sys.stdout.write(YELLOW)
+            sys.stdout.write(log_msg+'n')
+            sys.stdout.write(RESET)
+            sys.stdout.flush()
+            continue
+        building_name, parent = building_parents[floor['associated_building_id']]
+        if not isinstance(parent, CreateOperation):
+            # floor may exist with a different case, the index matches ignoring case
+            found, floor_id = location_index.checkFloor(floor['name'], parent)
+            if found:
+                floor['xiq_floor_id'] = floor_id
+                log_msg = f"There is already a floor with the name {floor['name']} in building {building_name}"
+                logger.warning(log_msg)
+                continue
+        # floors whose names only differ by case are one floor in XIQ
+        parent_key = parent.key if isinstance(parent, CreateOperation) else parent
+        key = ('FLOOR', parent_key, floor['name'].casefold())
+        if key in same_floors:
+            same_floors[key].append(floor)
+            continue
+        same_floors[key] = [floor]
+        plan.add(key, 'Floor', floor['name'], parent,
+                 lambda parent_id, floors=same_floors[key], building_name=building_name: createFloors(floors, building_name, parent_id))
+    return plan
+
+def updateSiteCountry(site_name, country_code):
+    # updateSite works on the site record loaded by the preceding checkSite
+    with site_update_lock:
+        xiq_site_exist, xiq_site_update, site_id = x.checkSite(site_name)
+        if xiq_site_update:
+            site_id = x.updateSite(site_name, country_code)
+            location_index.get(site_id)['country_code'] = country_code
+            log_msg = f"Site {site_name} is missing required country code, updated site with country code {country_code}\n"
+            logger.info(log_msg)
+            sys.stdout.write(YELLOW + log_msg + RESET)
+    return site_id
+
+def createBuilding(building, site_id):
+    data = building.copy()
+    del data['building_id']
+    del data['country_code']
+    del data['xiq_building_id']
+    if not data['address']:
+        data['address'] = {
+                "address": "Unknown",
+                "city": "Unknown",
+                "state": "Unknown",
+                "postal_code": "Unknown"
+            }
+    data['parent_id'] = f"{site_id}"
+    building_response = x.createBuilding(data)
+    building['xiq_building_id'] = building_response['id']
+    if building['xiq_building_id'] != 0:
+        log_msg = f"Building {building['name']} was successfully created."
+        sys.stdout.write(GREEN + log_msg + '\n\n' + RESET)
+        sys.stdout.flush()
+        logger.info(log_msg)
+        location_index.add(building_response, type='BUILDING', parent_id=site_id)
+        logger.info(f"Added {building_response['name']} to location index")
+    return building['xiq_building_id']
+
+def createFloors(floors, building_name, xiq_building_id):
+    # creates the floor once and sets its XIQ id on every Wing floor with that name
+    floor = floors[0]
+    data = floor.copy()
+    del data['associated_building_id']
+    del data['floor_id']
+    del data['xiq_floor_id']
+    data['parent_id'] = str(xiq_building_id)
+    floor_response = x.createFloor(data)
+    if floor_response in ('Duplicate_Name', 0):
+        xiq_floor_id = floor_response
     else:
-        count = len(location_tree)
-        site_number = count -1
-        loc_id = global_location_dic[0]['id']
-        children = global_location_dic[0]['children']
-        for i in range(0, count,1):
-            if i == site_number:
-                site_id = createSiteLoop(loc_id, location_tree[i], country_code)
+        xiq_floor_id = floor_response['id']
+    for same_floor in floors:
+        same_floor['xiq_floor_id'] = xiq_floor_id
+    # check for duplicate name - should not be returned as we look for this 2 different ways
+    if xiq_floor_id == 'Duplicate_Name':
+        log_msg = (f"Floor {floor['name']} already exists under building {building_name} but the script failed to find it twice... Skipping floor.")
+        logger.error(log_msg)
+        sys.stdout.write(YELLOW + log_msg + '\n\n' + RESET)
+        sys.stdout.flush()
+    elif xiq_floor_id != 0:
+        log_msg = (f"Floor {floor['name']} was successfully created in building {building_name}.")
+        logger.info(log_msg)
+        sys.stdout.write(GREEN + log_msg + '\n\n' + RESET)
+        sys.stdout.flush()
+        location_index.add(floor_response, type='FLOOR', parent_id=int(xiq_building_id))
+        logger.info(f"Added {floor_response['name']} from building {building_name} to location index")
+    return xiq_floor_id
+
+def indexCCGs(ccg_data):
+    # device id -> list of (ccg id, ccg name) for every CCG the device is in
+    ccg_index = {}
+    for ccg in ccg_data:
+        for device_id in ccg['device_ids'] or []:
+            ccg_index.setdefault(device_id, []).append((ccg['id'], ccg['name']))
+    return ccg_index
+
+def normalizeMacs(macs):
+    return macs.astype(str).str.upper().str.replace(r'[^0-9A-F]', '', regex=True)
+
+def indexWingAps():
+    # floor of each tech dump AP keyed by MAC address, and by hostname for the
+    # hostnames that only one AP in the tech dump uses
+    ap_macs = normalizeMacs(wing_ap_df['mac'])
+    floors_by_mac = pd.Series(wing_ap_df['location_id'].values, index=ap_macs)
+    floors_by_mac = floors_by_mac[~floors_by_mac.index.duplicated()]
+    name_counts = wing_ap_df['name'].value_counts()
+    ambiguous_names = set(name_counts.index[name_counts > 1])
+    floors_by_name = wing_ap_df.drop_duplicates('name').set_index('name')['location_id']
+    floors_by_name = floors_by_name[~floors_by_name.index.isin(ambiguous_names)]
+    return floors_by_mac, floors_by_name, ambiguous_names
+
+def ccgLookups(ccg_index):
+    # number of CCGs and name of the first CCG of each device, built once for all device pages
+    ccg_counts = pd.Series({device_id: len(memberships) for device_id, memberships in ccg_index.items()}, dtype=int)
+    ccg_names = pd.Series({device_id: memberships[0][1] for device_id, memberships in ccg_index.items()}, dtype=object)
+    return ccg_counts, ccg_names
+
+def wingFloorNames():
+    # tech dump floor name by XIQ floor id, as the str ids used in wing_ap_df
+    floor_names = wing_floor_df.loc[~wing_floor_df.index.duplicated(), 'name']
+    floor_names.index = floor_names.index.astype(str)
+    return floor_names
+
+def classifyDevices(device_df, ccg_lookups, wing_ap_index, floor_names):
+    # matches the XIQ devices to the tech dump APs by MAC address, falling back to
+    # the hostname, and to their CCG, then sorts them into the statuses reported
+    # by reportDevices
+    floors_by_mac, floors_by_name, ambiguous_names = wing_ap_index
+    device_match = device_df[['hostname']].copy()
+    if 'mac_address' in device_df:
+        device_macs = normalizeMacs(device_df['mac_address'])
+    else:
+        device_macs = pd.Series('', index=device_df.index)
+    mac_match = device_macs.isin(floors_by_mac.index)
+    name_match = ~mac_match & device_match['hostname'].isin(floors_by_name.index)
+    ambiguous_name = ~mac_match & device_match['hostname'].isin(ambiguous_names)
+    in_dump = mac_match | name_match
+    device_match['location_id'] = device_macs.map(floors_by_mac).where(mac_match, device_match['hostname'].map(floors_by_name))
+    device_ids = device_match.index.to_series()
+    ccg_counts, ccg_names = ccg_lookups
+    ccg_count = device_ids.map(ccg_counts).fillna(0)
+    # object dtype so .str works even when no device is in a CCG
+    device_match['ccg_name'] = device_ids.map(ccg_names).astype(object)
+    one_ccg = in_dump & (ccg_count == 1)
+    rfd_ccg = one_ccg & device_match['ccg_name'].str.contains("RFD-", regex=False).fillna(False).astype(bool)
+    device_match['rfd_name'] = device_match['ccg_name'].where(rfd_ccg).str.replace("RFD-", "", regex=False)
+
+    # the floors of each rf-domain's building only need to be checked once
+    rfd_errors = {}
+    for rfd_name in device_match.loc[rfd_ccg, 'rfd_name'].unique():
+        rfd_floor = location_index.getFloorsOfBuilding(rfd_name)
+        if 'errors' in rfd_floor:
+            rfd_errors[rfd_name] = ", ".join(rfd_floor['errors'])
+        elif len(rfd_floor) == 0:
+            rfd_errors[rfd_name] = f"There is not a building with the name '{rfd_name}'!!"
+    device_match['error'] = device_match['rfd_name'].map(rfd_errors)
+    device_match['floor_name'] = device_match['location_id'].map(floor_names)
+
+    device_match['status'] = 'not_in_dump'
+    device_match.loc[ambiguous_name, 'status'] = 'ambiguous_hostname'
+    device_match.loc[in_dump & (ccg_count == 0), 'status'] = 'no_ccg'
+    device_match.loc[in_dump & (ccg_count > 1), 'status'] = 'multiple_ccg'
+    device_match.loc[one_ccg & ~rfd_ccg, 'status'] = 'not_rfd_ccg'
+    device_match.loc[rfd_ccg & device_match['error'].notna(), 'status'] = 'rfd_error'
+    device_match.loc[rfd_ccg & device_match['error'].isna(), 'status'] = 'match'
+    device_match.loc[(device_match['status'] == 'match') & device_match['location_id'].isna(), 'status'] = 'floor_not_created'
+    return device_match
+
+def reportDevices(device_match):
+    for device in device_match.itertuples():
+        if device.status == 'not_in_dump':
+            log_msg = f"Device {device.hostname} has no location set but was not found in this Tech Dump."
+            logger.warning(log_msg)
+            sys.stdout.write(YELLOW)
+        elif device.status == 'ambiguous_hostname':
+            log_msg = f"Device {device.hostname} has no location set and its MAC address is not in this Tech Dump. Several APs in the Tech Dump use this hostname so it can't be matched."
+            logger.warning(log_msg)
+            sys.stdout.write(YELLOW)
+        elif device.status == 'match':
+            log_msg = f"Device {device.hostname} will be added to {device.rfd_name} on floor '{device.floor_name}'"
+            logger.info(log_msg)
+            sys.stdout.write(GREEN)
+        else:
+            if device.status == 'no_ccg':
+                log_msg = f"device {device.hostname} is not associated with a Cloud Config Group!!"
+            elif device.status == 'multiple_ccg':
+                log_msg = f"Device {device.hostname} is in multiple Cloud Config Groups!!"
+            elif device.status == 'not_rfd_ccg':
+                log_msg = f"Device {device.hostname} is in CCG '{device.ccg_name}' which is not an WiNG RFD created CCG!!"
+            elif device.status == 'floor_not_created':
+                log_msg = f"Can't move device {device.hostname}. Its floor in {device.rfd_name} was not created in XIQ!!"
             else:
-                if any(d['name'] == location_tree[i] for d in children):
-                    parent_dir = next(item for item in children if item["name"] == location_tree[i] )
-                    if parent_dir['type'] != "Site_Group":
-                        print(f"{parent_dir['name']} already exists, but it is not a Site Group!")
-                        loc_id = createLocLoop(loc_id, location_tree[i])
-                    else:
-                        print(f"Location {parent_dir['name']} was found in XIQ.")
-                        children = x.gatherChildren(parent_dir['id'])
-                        loc_id = parent_dir['id']
-                else:
-                    loc_id = createLocLoop(loc_id, location_tree[i])
-        return site_id
+                log_msg = f"Can't move device {device.hostname}. {device.error}"
+            logger.critical(log_msg)
+            sys.stdout.write(RED)
+        print(log_msg)
+        sys.stdout.write(RESET)
+
+def addDeviceAssignments(set_location, device_match):
+    # the devices of an rf-domain are moved to the floor of the first one found
+    matched = device_match[device_match['status'] == 'match']
+    for rfd_name, devices in matched.groupby('rfd_name', sort=False):
+        if rfd_name not in set_location:
+            set_location[rfd_name] = {"devices":{"ids":[]},"device_location":{"location_id":devices['location_id'].iloc[0],"x":0,"y":0,"latitude":0,"longitude":0}}
+        set_location[rfd_name]["devices"]["ids"].extend(devices.index.tolist())
 
 def gatherLocations():
-    print("Starting to collect root locations... ", end='')
+    print("Starting to collect the location tree... ", end='')
     sys.stdout.flush()
-    global_location_dic = x.gatherLocations()
+    global_location_dic = x.gatherLocationTree(walk=args.treewalk)
     print("Complete")
     sys.stdout.flush()
     return global_location_dic
 
+def gatherExistingSites():
+    print("\nStarting to collect all existing sites... ")
+    sys.stdout.flush()
+    return x.gatherExistingSites(pageSize)
+
 def gatherExistingBuildings():
     print("\nStarting to collect all existing buildings... ")
     sys.stdout.flush()
-    building_df = pd.DataFrame(x.gatherExistingBuildings(pageSize))
-    return building_df
+    return x.gatherExistingBuildings(pageSize)
 
 def gatherExistingFloors():
     print("\n Starting to collect all existing floors....")
     sys.stdout.flush()
-    floor_df = pd.DataFrame(x.gatherExistingFloors(pageSize))
-    if 'parent_id' in floor_df:
-        floor_df['parent_id'] = floor_df['parent_id'].apply(lambda x: str(x)) 
-    return floor_df
+    return x.gatherExistingFloors(pageSize)
     
 #MAIN
 
@@ -207,7 +447,7 @@ filename = filename.replace("'", "")
 
 print("Gathering Wing Data.... ", end='')
 sys.stdout.flush()
-x = Wing(filename, APNoFloorLogging= not args.noaplog, GEOAPILogging= not args.nogeolog, geoApiKey=geoApiKey)
+x = Wing(filename, APNoFloorLogging= not args.noaplog, GEOAPILogging= not args.nogeolog, geoApiKey=geoApiKey, workers=args.workers, geoRateLimit=args.georate)
 try:
     rawData, output_preview = x.exportFile()
 except ValueError as e:
@@ -229,6 +469,7 @@ except:
     logger.error(log_msg)
     raise SystemExit
 print("Complete\n")
+geoCache = x.geoCache
 
 #pprint(rawData)
 #print("\n\n")
@@ -300,166 +541,15 @@ if len(global_location_dic) == 0:
     sys.stdout.write("script is exiting...\n")
     sys.stdout.write(RESET)
     raise SystemExit
-building_df = gatherExistingBuildings()
+location_index = LocationIndex()
+location_index.addTree(global_location_dic)
+location_index.addAll(gatherExistingSites(), type='SITE')
+location_index.addAll(gatherExistingBuildings(), type='BUILDING')
+location_index.addAll(gatherExistingFloors(), type='FLOOR')
 
-floor_df = gatherExistingFloors()
-
-# Check Building
-if rawData['building']:
-    for building in rawData['building']:
-        xiq_building_exist = False
-        if not any(d['associated_building_id'] == building['building_id'] for d in rawData['floors']):
-            log_msg = (f"no floors were found for building {building['name']}. Skipping creation of building")
-            logger.info(log_msg)
-            continue
-        
-        # Check if building exists
-        if 'name' not in building_df:
-            xiq_building_exist = False
-        elif building['name'] in building_df['name'].to_list():
-            xiq_building_exist = True
-            filt = building_df['name'] == building['name']
-            building_id = building_df.loc[filt,'id'].values[0]
-
-        if xiq_building_exist:
-            building['xiq_building_id'] = str(building_id)
-            # just log that the building already exists
-            log_msg = (f"Building {building['name']} already exists! The Script will attempt to add Floors and APs to this building")
-            logger.critical(log_msg)
-        else:
-            # Check if site exists
-            site_name = building['location_tree'][-1]
-            xiq_site_exist, xiq_site_update, site_id = x.checkSite(site_name)
-            if xiq_site_exist:
-                if xiq_site_update:
-                    site_id = x.updateSite(site_name, building['country_code'])
-                    log_msg = f"Site {site_name} is missing required country code, updated site with country code {building['country_code']}\n"
-                    logger.info(log_msg)
-                    sys.stdout.write(YELLOW)
-                    sys.stdout.write(log_msg)
-                    sys.stdout.write(RESET)
-                data = building.copy()
-                del data['building_id']
-                del data['country_code']
-                del data['xiq_building_id']
-                if not data['address']:
-                    data['address'] = {
-                            "address": "Unknown",
-                            "city": "Unknown",
-                            "state": "Unknown",
-                            "postal_code": "Unknown"
-                        }
-                data['parent_id'] = f"{site_id}"
-                building_response = x.createBuilding(data)
-                building['xiq_building_id'] = building_response['id']
-                if building['xiq_building_id'] != 0:
-                    log_msg = f"Building {building['name']} was successfully created."
-                    sys.stdout.write(GREEN)
-                    sys.stdout.write(log_msg+'\n\n')
-                    sys.stdout.write(RESET)
-                    sys.stdout.flush()
-                    logger.info(log_msg)
-                    new_building_row = pd.DataFrame([building_response])
-                    building_df = pd.concat([building_df, new_building_row], axis=0, ignore_index=True)
-                    logger.info(f"Added {building_response['name']} to building_df")
-            else:
-                # Check/create hierarchy    
-                site_id = locationCreationLoop(building['location_tree'],building['country_code'])  
-                # Create Building 
-                data = building.copy()
-                del data['building_id']
-                del data['xiq_building_id']
-                del data['country_code']
-                if not data['address']:
-                    data['address'] = {
-                            "address": "Unknown",
-                            "city": "Unknown",
-                            "state": "Unknown",
-                            "postal_code": "Unknown"
-                        }
-                data['parent_id'] = f"{site_id}"
-                building_response = x.createBuilding(data)
-                building['xiq_building_id'] = building_response['id']
-                if building['xiq_building_id'] != 0:
-                    log_msg = f"Building {building['name']} was successfully created."
-                    sys.stdout.write(GREEN)
-                    sys.stdout.write(log_msg+'\n\n')
-                    sys.stdout.write(RESET)
-                    sys.stdout.flush()
-                    logger.info(log_msg)
-                    new_building_row = pd.DataFrame([building_response])
-                    building_df = pd.concat([building_df, new_building_row], axis=0, ignore_index=True)
-                    logger.info(f"Added {building_response['name']} to building_df")
-
-
-# Create Floor(s)
-wing_building_df = pd.DataFrame(rawData['building'])
-for floor in rawData['floors']:
-    xiq_floor_exist = False
-    if floor['associated_building_id'] == None:
-        log_msg = f"Floor '{floor['name']}' is not associated with the buildings in Wing so it will be skipped."
-        logger.warning(log_msg)
-        sys.stdout.write(YELLOW)
-        sys.stdout.write(log_msg+'n')
-        sys.stdout.write(RESET)
-        sys.stdout.flush()
-        continue
-    filt = wing_building_df['building_id'] == floor['associated_building_id']
-    xiq_building_id = wing_building_df.loc[filt, 'xiq_building_id'].values[0]
-    building_name = wing_building_df.loc[filt, 'name'].values[0]
-    if 'name' not in floor_df: # no FLoors exist
-        xiq_floor_exist = False 
-    elif floor['name'] in floor_df['name'].to_list() and xiq_building_id in floor_df['parent_id'].to_list():    
-            filt = (floor_df['name'] == floor['name']) & (floor_df['parent_id'] == xiq_building_id)
-            floor_id = floor_df.loc[filt,'id']
-            if floor_id.any():
-                floor_id = floor_id.values[0]
-                xiq_floor_exist = True
-            else:
-                # floor may exist but case doesn't match x.checkFloor will check for this
-                found, floor_id = x.checkFloor(floor['name'], xiq_building_id)
-                if found:
-                    xiq_floor_exist = True 
-    else:
-        #check if floor exists
-        found, floor_id = x.checkFloor(floor['name'], xiq_building_id)
-        if found:
-            xiq_floor_exist = True
-        
-    if xiq_floor_exist:
-        floor['xiq_floor_id'] = floor_id
-        log_msg = f"There is already a floor with the name {floor['name']} in building {building_name}"
-        logger.warning(log_msg)
-        sys.stdout.flush()
-        continue
-    # else create floor
-    data = floor.copy()
-    del data['associated_building_id']
-    del data['floor_id']
-    del data['xiq_floor_id']
-    data['parent_id'] = str(xiq_building_id)
-    floor_response = x.createFloor(data)
-    floor['xiq_floor_id'] = floor_response['id']
-  #  floor_df = gatherExistingFloors()
-    # check for duplicate name - should not be returned as we look for this 2 different ways
-    if floor['xiq_floor_id'] == 'Duplicate_Name':
-        log_msg = (f"Floor {floor['name']} already exists under building {building_name} but the script failed to find it twice... Skipping floor.")
-        logger.error(log_msg)
-        sys.stdout.write(YELLOW)
-        sys.stdout.write(log_msg+'\n\n')
-        sys.stdout.write(RESET)
-        sys.stdout.flush()
-        continue
-    if floor['xiq_floor_id'] != 0:
-        log_msg = (f"Floor {floor['name']} was successfully created in building {building_name}.")
-        logger.info(log_msg)
-        sys.stdout.write(GREEN)
-        sys.stdout.write(log_msg+'\n\n')
-        sys.stdout.write(RESET)
-        sys.stdout.flush()
-        new_floor_row = pd.DataFrame([floor_response])
-        floor_df = pd.concat([floor_df, new_floor_row], axis=0, ignore_index=True)
-        logger.info(f"Added {floor_response['name']} from building {building_name} to floor_df")
+# Create the site groups, sites, buildings and floors that are missing in XIQ
+location_plan = planLocationCreation()
+location_plan.execute(workers=args.createworkers)
 
 
 print("Collecting Devices...")
@@ -468,98 +558,79 @@ wing_floor_df = pd.DataFrame(rawData['floors'])
 wing_floor_df.set_index('xiq_floor_id',inplace=True)
 wing_ap_df = pd.DataFrame(rawData['aps'])
 
-# change location_id to xiq_floor_id
-listOfFloors = list(wing_ap_df['location_id'].unique())
-for floor_id in listOfFloors:
-    filt = wing_floor_df['floor_id'] == floor_id
-    xiq_id = (wing_floor_df.loc[filt].index[0])
-    wing_ap_df = wing_ap_df.replace({'location_id':{floor_id : str(xiq_id)}})
-
-# Get AP info from XIQ
-device_data = x.collectDevices(pageSize)
-device_df = pd.DataFrame(device_data)
-if len(device_df.index) == 0:
+# change location_id to xiq_floor_id. Floors that were skipped or failed to be
+# created have no XIQ id, their APs are kept without a location_id
+xiq_floor_ids = {floor['floor_id']: str(floor['xiq_floor_id']) for floor in rawData['floors'] if floor['xiq_floor_id'] not in (None, 0, 'Duplicate_Name')}
+wing_ap_df['location_id'] = wing_ap_df['location_id'].map(xiq_floor_ids)
+no_floor_aps = wing_ap_df.loc[wing_ap_df['location_id'].isna(), 'name']
+if len(no_floor_aps):
+    log_msg = f"{len(no_floor_aps)} APs in this Tech Dump are on floors that were not created in XIQ, these APs will not be moved"
+    logger.warning(log_msg + ": " + ", ".join(no_floor_aps))
+    sys.stdout.write(YELLOW + log_msg + "\n" + RESET)
+
+wing_ap_index = indexWingAps()
+if wing_ap_index[2]:
+    log_msg = f"{len(wing_ap_index[2])} hostnames are used by more than one AP in this Tech Dump, devices with these hostnames are only matched by MAC address"
+    logger.warning(log_msg + ": " + ", ".join(sorted(wing_ap_index[2])))
+    sys.stdout.write(YELLOW + log_msg + "\n" + RESET)
+
+# Get AP info from XIQ, the pages are matched as they arrive
+if args.targeted:
+    wing_macs = list(dict.fromkeys(wing_ap_df['mac']))
+    print(f"Looking up {len(wing_macs)} tech dump APs in XIQ by MAC address")
+    device_pages = iter([x.collectDevicesByMac(wing_macs, pageSize)])
+else:
+    device_pages = x.iterDevices(pageSize)
+first_page = next(device_pages, [])
+if len(first_page) == 0:
     print("\nNo devices were found without locations set")
     print("script is exiting...")
     raise SystemExit
-device_df.set_index('id',inplace=True)
-print(f"\nFound {len(device_df.index)} Devices without locations")
-
 
 
 print("Collecting CCGs...")
 ## Collect CCGs
 ccg_data = x.collectCCG(pageSize)
 #pp(ccg_data)
-ccg_df = pd.DataFrame(columns = ['device_id', 'ccg_id', 'ccg_name'])
-for ccg in ccg_data:
-    if ccg['device_ids']:
-        for device_id in ccg['device_ids']:
-            ccg_df = pd.concat([ccg_df,pd.DataFrame([{'device_id': device_id, 'ccg_id': ccg['id'], 'ccg_name': ccg['name']}])])
-#ccg_df = pd.DataFrame(ccg_data)
-ccg_df.set_index('device_id',inplace=True)
+ccg_index = indexCCGs(ccg_data)
+ccg_lookups = ccgLookups(ccg_index)
+multi_ccg_count = int((ccg_lookups[0] > 1).sum())
+print(f"Found {len(ccg_index)} devices in {len(ccg_data)} CCGs, {multi_ccg_count} of them are in multiple CCGs")
 
+# Assignments are only sent once every page is in. Moving devices earlier would
+# take them out of the nullField=LOCATION_ID results and shift the later pages.
 set_location = {}
-for device_id in device_df.index.tolist():
-    if device_df.loc[device_id,'hostname'] in wing_ap_df['name'].unique():
-        sys.stdout.write(RED)
-        if device_id not in ccg_df.index.tolist():
-            log_msg = (f"device {device_df.loc[device_id,'hostname']} is not associated with a Cloud Config Group!!")
-            logger.critical(log_msg)
-            print(log_msg)
-        else:
-            ccg_name = ccg_df.loc[device_id, 'ccg_name']
-            if not isinstance(ccg_name, str):
-                log_msg = (f"Device {device_df.loc[device_id,'hostname']} is in multiple Cloud Config Groups!!")
-                logger.critical(log_msg)
-                print(log_msg)
-            else:
-                if "RFD-" not in ccg_name:
-                    log_msg = (f"Device {device_df.loc[device_id,'hostname']} is in CCG '{ccg_name}' which is not an WiNG RFD created CCG!!")
-                    logger.critical(log_msg)
-                    print(log_msg)
-                else:
-                    rfd_name = ccg_name.replace("RFD-","")
-                    rfd_floor = x.getFloorsOfBuilding(rfd_name)
-                    if 'errors' in rfd_floor:
-                        errors = ", ".join(rfd_floor['errors'])
-                        log_msg = (f"Can't move device {device_df.loc[device_id,'hostname']}. {errors}")
-                        logger.critical(log_msg)
-                        print(log_msg)
-                    elif len(rfd_floor) == 0:
-                        log_msg = (f"Can't move device {device_df.loc[device_id,'hostname']}. There is not a building with the name '{rfd_name}'!!")
-                        logger.critical(log_msg)
-                        print(log_msg)
-                    else:
-                        sys.stdout.write(GREEN)
-                        if device_df.loc[device_id,'hostname'] in wing_ap_df['name'].unique():
-                            filt = wing_ap_df['name'] == device_df.loc[device_id,'hostname']
-                            floor_id = wing_ap_df.loc[filt,'location_id'].values[0]
-                            floor = {'id': floor_id, "name": wing_floor_df.loc[int(floor_id),'name']}
-                        else:
-                            floor = rfd_floor[-1]  
-                        log_msg = (f"Device {device_df.loc[device_id,'hostname']} will be added to {rfd_name} on floor '{floor['name']}'")
-                        logger.info(log_msg)
-                        print(log_msg)
-                        if rfd_name not in set_location:
-                            set_location[rfd_name] = {"devices":{"ids":[device_id]},"device_location":{"location_id":floor['id'],"x":0,"y":0,"latitude":0,"longitude":0}}
-                        else:
-                            set_location[rfd_name]["devices"]["ids"].append(device_id)
-    else:
-        sys.stdout.write(YELLOW)
-        log_msg = f"Device {device_df.loc[device_id,'hostname']} has no location set but was not found in this Tech Dump."
-        logger.warning(log_msg)
-        print(log_msg)
-
-    sys.stdout.write(RESET)
+device_count = 0
+floor_names = wingFloorNames()
+for device_page in itertools.chain([first_page], device_pages):
+    # a page can come back empty when the device count shrinks mid-stream
+    if not device_page:
+        continue
+    device_df = pd.DataFrame(device_page).set_index('id')
+    device_count += len(device_df.index)
+    device_match = classifyDevices(device_df, ccg_lookups, wing_ap_index, floor_names)
+    reportDevices(device_match)
+    addDeviceAssignments(set_location, device_match)
+print(f"\nFound {device_count} Devices without locations")
 
 move_device_count = 0
-for rfd in set_location:
-    print(f"Moving APs to {rfd}...", end="")
-    response = x.changeAPLocation(set_location[rfd])
-    print(response)
-    device_count = len(set_location[rfd]['devices']['ids'])
-    print(f"Moved {device_count} APs to {rfd}")
-    move_device_count += device_count
-
-print(f"\n{move_device_count} out of {len(device_df.index)} were moved to the correct locations.")
\ No newline at end of file
+print("Moving APs to their floors...")
+start = time.perf_counter()
+batch_results = x.assignDeviceLocations(set_location, batchSize=args.batchsize)
+elapsed = time.perf_counter() - start
+for result in batch_results:
+    batch_count = len(result['ids'])
+    if result['success']:
+        print(f"Moved {batch_count} APs to {result['name']} in {result['seconds']:.2f}s ({batch_count / max(result['seconds'], 0.001):.0f} APs/s)")
+        move_device_count += batch_count
+    else:
+        log_msg = f"Failed to move {batch_count} APs to {result['name']}"
+        logger.error(log_msg)
+        sys.stdout.write(RED + log_msg + "\n" + RESET)
+print(f"Sent {len(batch_results)} location assignment requests in {elapsed:.2f}s ({move_device_count / max(elapsed, 0.001):.0f} APs/s)")
+
+print(f"\n{move_device_count} out of {device_count} were moved to the correct locations.")
+print(x.apiCallStats())
+if geoCache:
+    print(geoCache.stats())
+    geoCache.close()
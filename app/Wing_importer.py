@@ -1,7 +1,11 @@
 #!/usr/bin/env python3
 import tarfile
+import io
+import csv
+import multiprocessing
 import json
 import os
+import posixpath
 import inspect
 import re
 import uuid
@@ -10,18 +14,22 @@ import shlex
 import shutil
 import logging
 import sys
+import threading
+import time
 import requests
-import glob
 import pandas as pd
 import numpy as np
 from tracemalloc import start
 import textfsm
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from types import MappingProxyType
 from pprint import pprint as pp
 current_dir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
 parent_dir = os.path.dirname(current_dir)
 sys.path.insert(0, parent_dir) 
 from requests.exceptions import HTTPError
 from app.mapImportLogger import logger
+from app.geoCache import GeoCache
 
 logger = logging.getLogger('MapImporter.WingImporter')
 
@@ -31,22 +39,139 @@ log_ap_floor_cfg = False
 PATH = current_dir
 os.environ["NET_TEXTFSM"]='{}/templates/'.format(PATH)
 
+# Tech dump members that are read by the importer
+TECH_DUMP_DOMAIN_MANAGERS = 'output/cli.show_global_domain_managers'
+TECH_DUMP_NVRAM = 'files/etc2/nvram'
+
+# startup-config block headers and the '!' line that closes a block
+RF_DOMAIN_HEADER = re.compile(r"rf-domain\s(.*)")
+DEVICE_HEADER = re.compile(r"\w{2}\d{3,4}\s((\S{2}-){5}\S{2})")
+BLOCK_END = re.compile(r"\s?!")
+
+# Reverse geo coordinate lookups - concurrent requests and requests per second
+GEO_WORKERS = 8
+GEO_RATE_LIMIT = 5
+
+UNKNOWN_ADDRESS = {
+    "address": "Unknown",
+    "city": "Unknown",
+    "state": "Unknown",
+    "postal_code": "Unknown"
+}
+
+# AP placement on the floorplan
+AP_GRID_SIZE = 11
+AP_GRID_SPACING = 9
+AP_PAGE_OFFSET = 3
+
+# Blocks sent to a worker process at a time when parsing with --workers
+PARSE_CHUNK_SIZE = 250
+
+
+def parseBlocks(template_name, blocks):
+    # Runs in the worker processes, so it has to be importable at module level
+    results = []
+    for block in blocks:
+        template = Wing.getTemplate(template_name)
+        results.append(template.ParseText(block))
+    return results
+
+
+_country_codes = None
+
+def getCountryCodes():
+    # Read-only ISO -> numeric country code mapping from cc_map.csv. The file is
+    # only read the first time it is needed and is shared by every Wing instance.
+    global _country_codes
+    if _country_codes is None:
+        codes = {}
+        with open(f"{PATH}/cc_map.csv", newline='', encoding='utf-8-sig') as f:
+            for row in csv.DictReader(f):
+                if row['CODE'].strip().isdigit():
+                    codes[row['ISO'].lower()] = int(row['CODE'])
+        _country_codes = MappingProxyType(codes)
+    return _country_codes
+
+
+class RateLimiter:
+    # Spaces out calls so no more than rate calls are started per second.
+    # Shared by all the threads doing lookups.
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_call = 0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
 class Wing:
-    def __init__(self, filename, APNoFloorLogging=True, GEOAPILogging=True, geoApiKey = ''):
+    # Compiled TextFSM templates shared by every Wing instance, keyed by file name
+    _templates = {}
+
+    def __init__(self, filename, APNoFloorLogging=True, GEOAPILogging=True, geoApiKey = '', workers=1, geoWorkers=GEO_WORKERS, geoRateLimit=GEO_RATE_LIMIT):
         self.filename = filename
+        self.workers = workers
+        self.executor = None
         self.APNoFloorLogging = APNoFloorLogging
         self.GEOAPILogging = GEOAPILogging
         if geoApiKey:
             self.apiKey = geoApiKey
             self.geo_coords = True
+            self.geoCache = GeoCache()
+            self.geoWorkers = geoWorkers
+            self.geoRateLimiter = RateLimiter(geoRateLimit)
+            self.geoSession = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=geoWorkers)
+            self.geoSession.mount('https://', adapter)
         else:
             self.geo_coords = False
+            self.geoCache = None
         self.projectFolder = f"{PATH}/project"
         if os.path.exists(self.projectFolder) and os.path.isdir(self.projectFolder):
             shutil.rmtree(self.projectFolder)
 
-        self.cc_df = pd.read_csv(f"{PATH}/cc_map.csv")
-        
+
+    @classmethod
+    def getTemplate(cls, template_name):
+        # Templates are only opened and compiled the first time they are used.
+        # Reset clears the parser state and results left by the previous parse.
+        if template_name not in cls._templates:
+            with open(f'{PATH}/templates/{template_name}') as f:
+                cls._templates[template_name] = textfsm.TextFSM(f)
+        template = cls._templates[template_name]
+        template.Reset()
+        return template
+
+    def __parseBlocks(self, template_name, blocks):
+        # Parses every block with the template and returns the rows in the same
+        # order as blocks. With more than one worker the blocks are split in
+        # chunks across a process pool.
+        if self.executor is None or len(blocks) <= PARSE_CHUNK_SIZE:
+            return parseBlocks(template_name, blocks)
+        chunks = [blocks[i:i + PARSE_CHUNK_SIZE] for i in range(0, len(blocks), PARSE_CHUNK_SIZE)]
+        results = []
+        for chunk_result in self.executor.map(parseBlocks, [template_name] * len(chunks), chunks):
+            results.extend(chunk_result)
+        return results
+
+    def __startExecutor(self):
+        if self.workers <= 1:
+            return
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            logger.warning(f"Parallel parsing is not supported on this platform. Ignoring workers setting of {self.workers}")
+            return
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('fork'))
+
+    def __stopExecutor(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
 
     def __convertToDict(self, lst, domain):
         temp_list = lst.copy()
@@ -73,7 +198,7 @@ class Wing:
     def __addressFromGeoCoor(self, lat_coor, long_coor):
         url = f"https://revgeocode.search.hereapi.com/v1/revgeocode?at={lat_coor},{long_coor}&apikey={self.apiKey}"
         try:
-            response = requests.get(url)
+            response = self.geoSession.get(url)
         except HTTPError as http_err:
             raise ValueError(f'HTTP error occurred: {http_err}') 
         if response is None:
@@ -109,12 +234,17 @@ class Wing:
     def __getRfDomainInfo(self):
         #domain info
         domain_data = []
+        domain_blocks = []
         for domain in self.rfDomains:
-            with open(f'{PATH}/templates/wing_rfdomain.textfsm') as f:
-                domain_template = textfsm.TextFSM(f)
-            my_regex = r"\nrf-domain\s" + re.escape(domain) + r"\n(.*?)\n\s?!"
-            domainInfo = re.findall(my_regex, self.startupContent, re.DOTALL)[0]
-            data = domain_template.ParseText(domainInfo)   
+            if ('rf-domain', domain) in self.blockIndex:
+                start, end = self.blockIndex[('rf-domain', domain)]
+                domain_blocks.append(self.startupContent[start:end])
+            else:
+                logger.warning(f"rf-domain {domain} was not found in the startup-config. Default values will be used")
+                domain_blocks.append('')
+        domain_template = self.getTemplate('wing_rfdomain.textfsm')
+        domain_rows = self.__parseBlocks('wing_rfdomain.textfsm', domain_blocks)
+        for domain, data in zip(self.rfDomains, domain_rows):
             try:
                 data = [dict(zip(domain_template.header, row)) for row in data][0]
                 data['name'] =  domain
@@ -126,65 +256,188 @@ class Wing:
                     data['locationTree'] = ["Site-" + domain]
             except IndexError:
                 data = {'name': domain, 'locationTree': ["Site-" + domain], 'floors': [], 'countryCode':'us'}
-            if 'geo_coor' in data:
-                if self.geo_coords:
-                    lat_coor, long_coor = data['geo_coor'].split()
-                    try:
-                        address = self.__addressFromGeoCoor(lat_coor, long_coor)
-                    except ValueError as e:
-                        logger.error(e)
-                        print(f"\n{e} trying to get address for rf-domain {data['name']}\nContinuing to gather data....", end='')
-                        logger.error(f"Address import failed. 'Unknown Address' will be used for {data['name']}")
-                        address = {
-                            "address": "Unknown",
-                            "city": "Unknown",
-                            "state": "Unknown",
-                            "postal_code": "Unknown"
-                        }
-                    except:
-                        log_msg = (f"Unknown error occurred with reverse Geo coordinates API with rf-domain {data['name']}")
-                        logger.error(log_msg)
-                        print(f"{log_msg}\nContinuing to gather data....", end='')
-                        logger.error(f"Address import failed. 'Unknown Address' will be used.")
-                        address = {
-                            "address": "Unknown",
-                            "city": "Unknown",
-                            "state": "Unknown",
-                            "postal_code": "Unknown"
-                        }
-                else:
-                    if self.GEOAPILogging == True:
-                        logger.warning(f"No API key was found for geo coordinates. Geo coordinates cannot be changed to physical address for rf-domain {data['name']}")
-                        print("\nNo API key was found for geo coordinates to do reverse geo coordinates. If you would like to get building addresses in XIQ from the geo coordinates please add an API key for platform.here.com")
-                        print("More information can be found in the readme.md file.\nContinuing to gather data....", end='')
-                    address = {
-                        "address": "Unknown",
-                        "city": "Unknown",
-                        "state": "Unknown",
-                        "postal_code": "Unknown"
-                    }
+            domain_data.append(data)
+
+        addresses = self.__resolveAddresses(domain_data)
+
+        for data in domain_data:
+            if data.get('geo_coor') and self.geo_coords:
+                address = addresses[tuple(data['geo_coor'].split())]
+            elif data.get('geo_coor'):
+                if self.GEOAPILogging == True:
+                    logger.warning(f"No API key was found for geo coordinates. Geo coordinates cannot be changed to physical address for rf-domain {data['name']}")
+                    print("\nNo API key was found for geo coordinates to do reverse geo coordinates. If you would like to get building addresses in XIQ from the geo coordinates please add an API key for platform.here.com")
+                    print("More information can be found in the readme.md file.\nContinuing to gather data....", end='')
+                address = dict(UNKNOWN_ADDRESS)
             else:
-                address = {
-                    "address": "Unknown",
-                    "city": "Unknown",
-                    "state": "Unknown",
-                    "postal_code": "Unknown"
-                }
+                address = dict(UNKNOWN_ADDRESS)
 
             data['address'] = address
             if data['countryCode'] == '':
                 data['countryCode'] = 'us'
             # change Country ISO to County Code - uses CSV file cc_map.csv
-            filt = self.cc_df['ISO'] == data['countryCode']
-            cc =  "Unknown" if pd.isna(self.cc_df.loc[filt,'CODE'].values[0]) else int(self.cc_df.loc[filt,'CODE'].values[0])
+            cc = getCountryCodes().get(data['countryCode'].lower(), "Unknown")
             if cc == "Unknown":
                 logger.error(f"{data['name']}'s country ISO was not found. Defaulting to US 840. You can change later if needed.")
                 data['countryCode'] = 840
             else:
                 data['countryCode'] = cc
-            domain_data.append(data)
         return(domain_data)
 
+    def __lookupAddress(self, lat_coor, long_coor):
+        self.geoRateLimiter.wait()
+        return self.__addressFromGeoCoor(lat_coor, long_coor)
+
+    def __resolveAddresses(self, domain_data):
+        # Collects the unique geo coordinates of all rf-domains, answers what it
+        # can from the cache and looks up the rest concurrently against the
+        # HERE API. Returns {(lat, long): address}.
+        addresses = {}
+        if not self.geo_coords:
+            return addresses
+        coor_domains = {}
+        for data in domain_data:
+            if data.get('geo_coor'):
+                coor_domains.setdefault(tuple(data['geo_coor'].split()), []).append(data['name'])
+        lookups = {}
+        for (lat_coor, long_coor) in coor_domains:
+            address = self.geoCache.get(lat_coor, long_coor)
+            if address is None:
+                lookups[(lat_coor, long_coor)] = None
+            else:
+                addresses[(lat_coor, long_coor)] = address
+        if not lookups:
+            return addresses
+        with ThreadPoolExecutor(max_workers=self.geoWorkers) as executor:
+            for coor in lookups:
+                lookups[coor] = executor.submit(self.__lookupAddress, *coor)
+        for (lat_coor, long_coor), future in lookups.items():
+            domains = ", ".join(coor_domains[(lat_coor, long_coor)])
+            try:
+                address = future.result()
+            except ValueError as e:
+                logger.error(e)
+                print(f"\n{e} trying to get address for rf-domain {domains}\nContinuing to gather data....", end='')
+                logger.error(f"Address import failed. 'Unknown Address' will be used for {domains}")
+                address = dict(UNKNOWN_ADDRESS)
+                self.geoCache.set(lat_coor, long_coor, address, found=False)
+            except:
+                log_msg = (f"Unknown error occurred with reverse Geo coordinates API with rf-domain {domains}")
+                logger.error(log_msg)
+                print(f"{log_msg}\nContinuing to gather data....", end='')
+                logger.error(f"Address import failed. 'Unknown Address' will be used.")
+                address = dict(UNKNOWN_ADDRESS)
+                self.geoCache.set(lat_coor, long_coor, address, found=False)
+            else:
+                self.geoCache.set(lat_coor, long_coor, address)
+            addresses[(lat_coor, long_coor)] = address
+        return addresses
+
+
+    def __layoutFloorAps(self):
+        # Spaces out the APs of each floor onto the floorplan. APs are placed in
+        # rows of AP_GRID_SIZE, AP_GRID_SPACING apart, and once a page of
+        # AP_GRID_SIZE rows is full the next page is shifted right by
+        # AP_PAGE_OFFSET. Returns {(rf-domain, floor): DataFrame of APs}.
+        if self.ap_df.empty:
+            return {}
+        position = self.ap_df.groupby(['rfdomain', 'floor'], sort=False).cumcount().to_numpy()
+        page, index = np.divmod(position, AP_GRID_SIZE * AP_GRID_SIZE)
+        row, col = np.divmod(index, AP_GRID_SIZE)
+        layout = pd.DataFrame({
+            'rfdomain': self.ap_df['rfdomain'],
+            'floor': self.ap_df['floor'],
+            'name': self.ap_df['name'],
+            'x': col * AP_GRID_SPACING + page * AP_PAGE_OFFSET,
+            'y': row * AP_GRID_SPACING,
+            'mac': self.ap_df['macaddr'].str.replace("-", "")
+        })
+        return dict(list(layout.groupby(['rfdomain', 'floor'], sort=False)))
+
+    def __indexStartupBlocks(self):
+        # Single pass over the startup-config recording the offsets of every
+        # rf-domain and device block, keyed by (block type, name). The rf-domain
+        # offsets cover the lines under the header, the device offsets start at
+        # the model/MAC header. Both end at the '!' line closing the block.
+        self.blockIndex = {}
+        content = self.startupContent
+        block = None
+        pos = 0
+        while pos < len(content):
+            eol = content.find('\n', pos)
+            if eol == -1:
+                eol = len(content)
+            line = content[pos:eol]
+            if block:
+                if BLOCK_END.match(line):
+                    key, start = block
+                    if key not in self.blockIndex:
+                        self.blockIndex[key] = (start, pos)
+                    block = None
+            elif RF_DOMAIN_HEADER.match(line):
+                name = RF_DOMAIN_HEADER.match(line).group(1)
+                block = (('rf-domain', name), eol + 1)
+            elif not line[:1].isspace() and DEVICE_HEADER.search(line):
+                match = DEVICE_HEADER.search(line)
+                block = (('ap', match.group(1)), pos + match.start())
+            pos = eol + 1
+        return self.blockIndex
+
+    def __isNeededMember(self, member_name):
+        if member_name == TECH_DUMP_DOMAIN_MANAGERS:
+            return True
+        folder, file_name = posixpath.split(member_name)
+        return folder == TECH_DUMP_NVRAM and "startup-config" in file_name and "bak" not in member_name
+
+    def __readTechDump(self):
+        # Walk the tarball members once and only read the files that are used.
+        # Nothing is extracted to disk.
+        techDump = {}
+        try:
+            with tarfile.open(self.filename, 'r|*') as file_obj:
+                for member in file_obj:
+                    if not member.isfile():
+                        continue
+                    member_name = posixpath.normpath(member.name).lstrip('/')
+                    if not self.__isNeededMember(member_name):
+                        continue
+                    raw = file_obj.extractfile(member).read()
+                    techDump[member_name] = io.TextIOWrapper(io.BytesIO(raw)).read()
+        except (EOFError, tarfile.ReadError):
+            logger.warning(f'EOFError for {self.filename} when extracting. Attempting script anyways, but possibly a corrupt file was used')
+        return techDump
+
+    def reconcileFloors(self, data, ap_data):
+        # Check APs for additional floors. A floor set on an AP but missing from its
+        # rf-domain is added to the rf-domain, an AP without a floor gets the first one.
+        # rf-domain name -> floors, using dict keys as an ordered set
+        domain_floors = {}
+        for domain in data:
+            if isinstance(domain['floors'], list):
+                domain_floors[domain['name']] = dict.fromkeys(domain['floors'])
+        for ap in ap_data:
+            if ap['rfdomain'] in domain_floors:
+                floors = domain_floors[ap['rfdomain']]
+            else:
+                floors = {}
+            if ap['floor']:
+                if ap['floor'] not in floors:
+                    floors[ap['floor']] = None
+                    logger.warning(f"AP {ap['name']} in rf-domain {ap['rfdomain']} is set to floor {ap['floor']} which is not a floor configured in the rf-domain. Floor will be created in XIQ")
+                else:
+                    continue
+            elif floors:
+                ap['floor'] = next(iter(floors))
+                if self.APNoFloorLogging == True:
+                    logger.warning(f"AP {ap['name']} in rf-domain {ap['rfdomain']} is not set to a floor. This AP will be placed on floor {ap['floor']}.")
+            else:
+                ap['floor'] = 'floor1'
+                floors[ap['floor']] = None
+                if self.APNoFloorLogging == True:
+                    logger.warning(f"AP {ap['name']} in rf-domain {ap['rfdomain']} is not set to a floor and no floors are configured in the rf-domain. Floor 'floor1' will be created in XIQ")
+        for domain in data:
+            if domain['name'] in domain_floors:
+                domain['floors'] = list(domain_floors[domain['name']])
 
     def exportFile(self):
         data = {} 
@@ -195,93 +448,57 @@ class Wing:
             logger.error(log_msg)
             raise ValueError(log_msg)   
             
+        techDump = {}
         if flag:
-            try:
-                file_obj = tarfile.open(self.filename, 'r')
-                file_obj.extractall('app/project')
-                file_obj.close()
-            except EOFError:
-                logger.warning(f'EOFError for {self.filename} when extracting. Attempting script anyways, but possibly a corrupt file was used')
-                if file_obj:
-                    file_obj.close()
-        
+            techDump = self.__readTechDump()
+
         self.rfDomains = []
-        try:
-            with open(f"{self.projectFolder}/output/cli.show_global_domain_managers", "r") as f:
-                content = f.read().splitlines()
-                content = content[4:-2]
-                for line in content:
-                    self.rfDomains.append(re.sub(r"\s+", " ", line).split(" ")[1])
-        except FileNotFoundError:
+        if TECH_DUMP_DOMAIN_MANAGERS not in techDump:
             log_msg = "cli.show_global_domain_managers was not found in output folder of tech dump"
             logger.error(log_msg)
             raise ValueError(log_msg)
+        content = techDump[TECH_DUMP_DOMAIN_MANAGERS].splitlines()
+        content = content[4:-2]
+        for line in content:
+            self.rfDomains.append(re.sub(r"\s+", " ", line).split(" ")[1])
         #print(self.rfDomains)
 
         self.startupContent = ''
-        startupPath = (f"{self.projectFolder}/files/etc2/nvram/")
-        list_of_files = sorted( filter( os.path.isfile,
-                                glob.glob(startupPath + '*') ) )
-        for thisfile in list_of_files:
-            if thisfile.__contains__("startup-config") and ("bak" not in thisfile):
-                try:
-                    with open(thisfile, "r") as f:
-                        self.startupContent += f.read()
-                except FileNotFoundError:
-                    log_msg = "The startup-config file was not found in the tech dump"
-                    raise ValueError(log_msg)
-
-        data = self.__getRfDomainInfo()
-
-        #pprint(data)
-        
-        self.domain_df = pd.DataFrame(data)
-        #create an empty location id column
-        self.domain_df['parent'] = None
-        #print(self.domain_df)
+        for member_name in sorted(techDump):
+            if member_name != TECH_DUMP_DOMAIN_MANAGERS:
+                self.startupContent += techDump[member_name]
+        self.__indexStartupBlocks()
 
+        self.__startExecutor()
+        try:
+            data = self.__getRfDomainInfo()
+            ap_blocks = [self.startupContent[start:end] for (block_type, name), (start, end) in self.blockIndex.items() if block_type == 'ap']
+            ap_rows = self.__parseBlocks('wing_apconfig.textfsm', ap_blocks)
+        finally:
+            self.__stopExecutor()
 
         # Collect AP data from tech dump
         ap_data = []
-        ap_info = re.findall(r"(\w{2}\d{3,4}\s(\S{2}-){5}\S{2}.*?)!", self.startupContent, re.DOTALL)
-        for ap in ap_info:
-
-            ap = ap[0]
-            with open(f'{PATH}/templates/wing_apconfig.textfsm') as f:
-                ap_template = textfsm.TextFSM(f)
-            data = ap_template.ParseText(ap)
+        ap_template = self.getTemplate('wing_apconfig.textfsm')
+        for ap_row in ap_rows:
             try:
-                data = [dict(zip(ap_template.header, row)) for row in data][0]
+                ap = [dict(zip(ap_template.header, row)) for row in ap_row][0]
             except IndexError:
                 log_msg = ("Failed to parse AP template correctly")
                 print('\n' + log_msg + ": check log for details. Skipping AP \nContinuing to gather data....", end='')
                 logger.error(log_msg)
                 logger.info("Headers are: " + ", ".join(ap_template.header))
-                logger.info("Values are: " + ", ".join(data[0]))
+                logger.info("Values are: " + ", ".join(ap_row[0]))
                 continue
-            ap_data.append(data)
-        # Check APs for additional floors
+            ap_data.append(ap)
 
-        for ap in ap_data:
-            filt = self.domain_df['name'] == ap['rfdomain']
-            floorList = self.domain_df.loc[filt,'floors'].values[0]
-            if not isinstance(floorList, list):
-                floorList = []
-            if ap['floor']:
-                if ap['floor'] not in floorList:
-                    floorList.append(ap['floor'])
-                    logger.warning(f"AP {ap['name']} in rf-domain {ap['rfdomain']} is set to floor {ap['floor']} which is not a floor configured in the rf-domain. Floor will be created in XIQ")
-                else:
-                    continue
-            elif floorList:
-                ap['floor'] = floorList[0]
-                if self.APNoFloorLogging == True:
-                    logger.warning(f"AP {ap['name']} in rf-domain {ap['rfdomain']} is not set to a floor. This AP will be placed on floor {floorList[0]}.")
-            else:
-                ap['floor'] = 'floor1'
-                floorList.append(ap['floor'])
-                if self.APNoFloorLogging == True:
-                    logger.warning(f"AP {ap['name']} in rf-domain {ap['rfdomain']} is not set to a floor and no floors are configured in the rf-domain. Floor 'floor1' will be created in XIQ")
+        self.reconcileFloors(data, ap_data)
+
+        #pprint(data)
+
+        self.domain_df = pd.DataFrame(data)
+        #create an empty location id column
+        self.domain_df['parent'] = None
         #print(self.domain_df)
 
 
@@ -290,9 +507,11 @@ class Wing:
         #print(self.ap_df)
         
         #Create Location dictionary and validate location info
-        location_df = pd.DataFrame(columns= ['type', 'name', 'parent', 'child'])
+        # location name -> {'type', 'name', 'parent', 'child', 'children'}
+        location_graph = {}
+        ap_rfdomains = set(self.ap_df['rfdomain']) if 'rfdomain' in self.ap_df else set()
         for index,row in self.domain_df.iterrows():
-            if row['name'] not in self.ap_df['rfdomain'].unique():
+            if row['name'] not in ap_rfdomains:
                 logger.warning(f"No APs were found in rf-domain {row['name']}. This rf-domain will not be created in XIQ")
                 continue
             if isinstance(row['floors'], list):
@@ -312,46 +531,38 @@ class Wing:
                     else:
                         child = location_list[i+1]
                     name = location_list[i]
-                    if location_list[i] in location_df['name'].unique():
-                        filt = (location_df['name'] == location_list[i])
-                        matchLocation = location_df.loc[filt]
-                        if len(matchLocation) == 1:
-                            if child == matchLocation['child'].values[0] and parent != matchLocation['parent'].values[0]:
-                                logger.warning(f"fixing locations in rf-domain {row['name']} - changing {location_list[i-1]} from {location_list[i-1]} to {matchLocation['parent'].values[0]}")
-                                parent = matchLocation['parent'].values[0]
-                            elif child != matchLocation['child'].values[0] and parent != matchLocation['parent'].values[0]:
-                                name = f"{location_list[i]}_{location_list[i-1]}"
-                                name = name.replace(" ", "")
-                                if len(name) > 32:
-                                    name = name[0:31]
-                                logger.warning(f"Changing name of location in rf-domain {row['name']} due to the name being used for another location. New name is {name}")
-
-                        else:
-                            logger.error(f"Fatal Error with Locations in {row['name']} removing all locations for rf-domain {row['name']}")
-                            row['parent'] = 'Global'
+                    if name in location_graph:
+                        matchLocation = location_graph[name]
+                        if child == matchLocation['child'] and parent != matchLocation['parent']:
+                            logger.warning(f"fixing locations in rf-domain {row['name']} - changing {location_list[i-1]} from {location_list[i-1]} to {matchLocation['parent']}")
+                        elif child != matchLocation['child'] and parent != matchLocation['parent']:
+                            name = f"{location_list[i]}_{location_list[i-1]}"
+                            name = name.replace(" ", "")
+                            if len(name) > 32:
+                                name = name[0:31]
+                            logger.warning(f"Changing name of location in rf-domain {row['name']} due to the name being used for another location. New name is {name}")
                     else:
-                        temp_df = pd.DataFrame([{'type': type, 'name': name, 'parent': parent, 'child': child}])
-                        location_df = pd.concat([location_df, temp_df], ignore_index=True)
+                        location_graph[name] = {'type': type, 'name': name, 'parent': parent, 'child': child, 'children': []}
+                        if parent in location_graph:
+                            location_graph[parent]['children'].append(name)
                 if location_list:
                     self.domain_df.loc[index,'parent'] = location_list[-1]
                 else:
                     self.domain_df.loc[index,'parent'] = 'Global'
 
-       
-        
         #Build data for API calls and data for print screen
+        floor_layout = self.__layoutFloorAps()
         self.wingData = {'building':[],'floors':[],'aps':[]}
         output_data = {}
         for index,row in self.domain_df.iterrows():
-            if row['name'] not in self.ap_df['rfdomain'].unique():
+            if row['name'] not in ap_rfdomains:
                 continue
             if isinstance(row['floors'], list):
                 location_tree = []
                 parent = row['parent']
                 while parent != 'Global':
-                    filt = location_df['name'] == parent
                     location_tree.append(parent)
-                    parent = (location_df.loc[filt,'parent'].values[0])
+                    parent = location_graph[parent]['parent']
                 current_level = output_data
                 for location in reversed(location_tree):
                     if location not in current_level:
@@ -391,43 +602,18 @@ class Wing:
                     self.wingData['floors'].append(floor_data)
                     if floor not in current_level:
                         current_level[floor]={'deviceCount': 0}
-                    filt = (self.ap_df['floor'] == floor) & (self.ap_df['rfdomain'] == row['name'])
-                    floor_aps = self.ap_df.loc[filt]
-                    # Variables used to space out APs onto floorplan
-                    rangeList = [*range(0, 92, 9)] 
-                    #rangeList = [*range(0, 300, 30)]
-                    pageCount = 0
-                    xList = []
-                    yList = []    
-                    for index, ap in floor_aps.iterrows():
-                        # Spacing out the X,Y of the APs
-                        if not yList:
-                            xList = rangeList.copy()
-                            yList = rangeList.copy()
-                        if not xList:
-                            xList = rangeList.copy()
-                            yList.pop(0)
-                        apX = xList[0] + pageCount
-                        xList.pop(0)
-                        apY = yList[0]
-                        if (len(xList) == 0) and (len(yList) == 1):
-                            yList.pop(0)
-                            pageCount += 3
-                        # AP Data
-                        ap_data = {
-                            'name': ap['name'],
-                            'x': apX,
-                            'y': apY,
-                            'location_id':str(floor_id),
-                            'mac': ap['macaddr'].replace("-",""),
-                            'xiq_id': None
-                        }
-                        self.wingData['aps'].append(ap_data)
-                        current_level[floor]['deviceCount'] += 1
-        self.removeProjectFolder()
+                    if (row['name'], floor) not in floor_layout:
+                        continue
+                    floor_aps = floor_layout[(row['name'], floor)].assign(location_id=str(floor_id), xiq_id=None)
+                    floor_aps = floor_aps[['name', 'x', 'y', 'location_id', 'mac', 'xiq_id']].to_dict('records')
+                    self.wingData['aps'].extend(floor_aps)
+                    current_level[floor]['deviceCount'] += len(floor_aps)
 
 
         return self.wingData, output_data  
                      
     def removeProjectFolder(self):
-        shutil.rmtree(current_dir + '/project') 
\ No newline at end of file
+        # The tech dump is read straight from the tarball, so this folder only
+        # exists if it was left behind by an older version of the script
+        if os.path.isdir(self.projectFolder):
+            shutil.rmtree(self.projectFolder)
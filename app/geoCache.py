@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+import logging
+import os
+import json
+import sqlite3
+import time
+from app.mapImportLogger import logger
+
+logger = logging.getLogger('MapImporter.geoCache')
+
+PATH = os.path.dirname(os.path.abspath(__file__))
+
+# Cached addresses are kept for 30 days, failed lookups ('Unknown') for 1 day
+GEO_CACHE_TTL = 30 * 24 * 60 * 60
+GEO_CACHE_NEGATIVE_TTL = 24 * 60 * 60
+GEO_CACHE_MAX_ENTRIES = 10000
+# Coordinates are rounded to 5 decimals (~1 meter) before being used as the key
+GEO_CACHE_PRECISION = 5
+
+
+class GeoCache:
+    def __init__(self, filename=f"{PATH}/geo_cache.db", ttl=GEO_CACHE_TTL, negative_ttl=GEO_CACHE_NEGATIVE_TTL, max_entries=GEO_CACHE_MAX_ENTRIES):
+        self.filename = filename
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS geocode (coor TEXT PRIMARY KEY, address TEXT, found INTEGER, updated REAL)")
+        self.conn.commit()
+
+    def __key(self, lat_coor, long_coor):
+        return f"{float(lat_coor):.{GEO_CACHE_PRECISION}f},{float(long_coor):.{GEO_CACHE_PRECISION}f}"
+
+    def get(self, lat_coor, long_coor):
+        key = self.__key(lat_coor, long_coor)
+        row = self.conn.execute("SELECT address, found, updated FROM geocode WHERE coor = ?", (key,)).fetchone()
+        if row:
+            address, found, updated = row
+            ttl = self.ttl if found else self.negative_ttl
+            if time.time() - updated < ttl:
+                self.hits += 1
+                logger.info(f"Found address for geo coordinates {key} in cache")
+                return json.loads(address)
+        self.misses += 1
+        return None
+
+    def set(self, lat_coor, long_coor, address, found=True):
+        key = self.__key(lat_coor, long_coor)
+        self.conn.execute("INSERT OR REPLACE INTO geocode (coor, address, found, updated) VALUES (?, ?, ?, ?)",
+                          (key, json.dumps(address), int(found), time.time()))
+        self.__evict()
+        self.conn.commit()
+
+    def __evict(self):
+        # drop the oldest entries once the cache grows past max_entries
+        self.conn.execute("DELETE FROM geocode WHERE coor NOT IN (SELECT coor FROM geocode ORDER BY updated DESC LIMIT ?)", (self.max_entries,))
+
+    def stats(self):
+        return f"Geo coordinate cache: {self.hits} hits, {self.misses} misses"
+
+    def close(self):
+        self.conn.close()
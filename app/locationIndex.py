@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+import logging
+import threading
+from app.mapImportLogger import logger
+
+logger = logging.getLogger('MapImporter.locationIndex')
+
+
+class LocationIndex:
+    # Local copy of the XIQ location tree (global, site groups, sites, buildings
+    # and floors). It is loaded once and kept up to date as locations are created,
+    # so existence checks don't need a round-trip to XIQ.
+    def __init__(self):
+        self.locations = {}
+        self.byName = {}
+        self.byParent = {}
+        self.childIds = {}
+        # locations can be added by several creation threads
+        self.lock = threading.Lock()
+
+    def __key(self, name):
+        return name.casefold()
+
+    def add(self, location, type=None, parent_id=None):
+        with self.lock:
+            return self.__add(location, type, parent_id)
+
+    def __add(self, location, type, parent_id):
+        loc_id = int(location['id'])
+        if loc_id in self.locations:
+            # seen before (tree and collection), keep the richer data
+            entry = self.locations[loc_id]
+            self.__unlink(entry)
+            entry.update(location)
+        else:
+            entry = dict(location)
+            self.locations[loc_id] = entry
+        entry['id'] = loc_id
+        if type is not None:
+            entry['type'] = type
+        if parent_id is not None:
+            entry['parent_id'] = parent_id
+        if entry.get('parent_id') not in (None, ''):
+            entry['parent_id'] = int(entry['parent_id'])
+        else:
+            entry['parent_id'] = None
+        entry.pop('children', None)
+        key = self.__key(entry['name'])
+        self.byName.setdefault(key, []).append(loc_id)
+        self.byParent.setdefault((entry['parent_id'], key), []).append(loc_id)
+        self.childIds.setdefault(entry['parent_id'], {})[loc_id] = None
+        return entry
+
+    def __unlink(self, entry):
+        key = self.__key(entry['name'])
+        self.byName[key].remove(entry['id'])
+        self.byParent[(entry['parent_id'], key)].remove(entry['id'])
+        del self.childIds[entry['parent_id']][entry['id']]
+
+    def addAll(self, locations, type=None):
+        for location in locations:
+            self.add(location, type=type)
+
+    def addTree(self, tree, parent_id=None):
+        # tree as returned by /locations/tree, children are added recursively
+        for location in tree:
+            self.add(location, parent_id=parent_id)
+            if location.get('children'):
+                self.addTree(location['children'], parent_id=int(location['id']))
+
+    def get(self, loc_id):
+        return self.locations.get(int(loc_id))
+
+    def __match(self, ids, name, ignoreCase, type):
+        matches = [self.locations[loc_id] for loc_id in ids]
+        if type is not None:
+            matches = [loc for loc in matches if loc['type'] == type]
+        if not ignoreCase:
+            matches = [loc for loc in matches if loc['name'] == name]
+        else:
+            # an exact match comes first
+            matches.sort(key=lambda loc: loc['name'] != name)
+        return matches
+
+    def findByName(self, name, type=None, ignoreCase=False):
+        ids = self.byName.get(self.__key(name), [])
+        return self.__match(ids, name, ignoreCase, type)
+
+    def findChild(self, parent_id, name, type=None, ignoreCase=False):
+        ids = self.byParent.get((int(parent_id), self.__key(name)), [])
+        matches = self.__match(ids, name, ignoreCase, type)
+        return matches[0] if matches else None
+
+    def children(self, parent_id, type=None):
+        children = [self.locations[loc_id] for loc_id in self.childIds.get(int(parent_id), {})]
+        if type is not None:
+            children = [loc for loc in children if loc['type'] == type]
+        return children
+
+    def checkSite(self, name):
+        # same return as XIQ.checkSite - found, needs country code update, site id
+        sites = self.findByName(name, type='SITE')
+        if not sites:
+            return False, False, 0
+        site = sites[0]
+        update = not site.get('country_code')
+        return True, update, site['id']
+
+    def getFloorsOfBuilding(self, rfd_name):
+        # same return as XIQ.getFloorsOfBuilding - list of floors or {'errors': [...]}
+        buildings = self.findByName(rfd_name, type='BUILDING')
+        if not buildings:
+            return {'errors': [f"No building was found with the name {rfd_name}"]}
+        if len(buildings) > 1:
+            log_msg = f"Multiple buildings found with the name {rfd_name}"
+            logger.critical(buildings)
+            return {'errors': [log_msg]}
+        return self.children(buildings[0]['id'], type='FLOOR')
+
+    def checkFloor(self, name, parent_id):
+        # same return as XIQ.checkFloor - floor names are matched ignoring case
+        floor = self.findChild(parent_id, name, type='FLOOR', ignoreCase=True)
+        if floor is None:
+            return False, 0
+        return True, floor['id']
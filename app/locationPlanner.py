@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from app.mapImportLogger import logger
+
+logger = logging.getLogger('MapImporter.locationPlanner')
+
+# Locations created in XIQ at the same time
+CREATE_WORKERS = 8
+
+
+class CreateOperation:
+    # One location to create. parent is the XIQ id of an existing location or
+    # the CreateOperation that creates it. action is called with the parent's
+    # XIQ id and returns the id of the new location.
+    def __init__(self, key, kind, name, parent, action):
+        self.key = key
+        self.kind = kind
+        self.name = name
+        self.parent = parent
+        self.action = action
+        self.xiq_id = None
+        if isinstance(parent, CreateOperation):
+            self.level = parent.level + 1
+        else:
+            self.level = 0
+
+    def parentId(self):
+        if isinstance(self.parent, CreateOperation):
+            return self.parent.xiq_id
+        return self.parent
+
+
+class LocationPlan:
+    # DAG of the locations to create, where every location depends on its parent.
+    # Operations are grouped into levels by their depth below an existing
+    # location, the operations of a level are run at the same time once the
+    # level before it is complete.
+    def __init__(self):
+        self.operations = {}
+
+    def add(self, key, kind, name, parent, action):
+        # the same location is only created once, the first operation added wins
+        if key not in self.operations:
+            self.operations[key] = CreateOperation(key, kind, name, parent, action)
+        return self.operations[key]
+
+    def get(self, key):
+        return self.operations.get(key)
+
+    def levels(self):
+        levels = {}
+        for operation in self.operations.values():
+            levels.setdefault(operation.level, []).append(operation)
+        return [levels[level] for level in sorted(levels)]
+
+    def execute(self, workers=CREATE_WORKERS):
+        levels = self.levels()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for level, operations in enumerate(levels):
+                logger.info(f"Creating level {level} of the location plan with {len(operations)} operations")
+                # results are read so an error in any operation is raised here
+                list(executor.map(self.__run, operations))
+        logger.info(f"Location plan complete - {len(self.operations)} operations in {len(levels)} levels")
+
+    def __run(self, operation):
+        parent_id = operation.parentId()
+        if parent_id in (None, 0, 'Duplicate_Name'):
+            log_msg = f"{operation.kind} {operation.name} was not created because its parent location failed to be created"
+            logger.error(log_msg)
+            print(log_msg)
+            operation.xiq_id = 0
+            return
+        operation.xiq_id = operation.action(parent_id)
@@ -6,7 +6,12 @@ import sys
 import json
 import requests
 import time
+import threading
+import random
+import email.utils
+import collections
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 current_dir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
 parent_dir = os.path.dirname(current_dir)
 sys.path.insert(0, parent_dir) 
@@ -19,9 +24,62 @@ logger = logging.getLogger('MapImporter.xiq_exporter')
 
 PATH = current_dir
 
+# Connections kept open to XIQ by the shared session
+XIQ_POOL_SIZE = 20
+# Pages of a paginated collection fetched at the same time
+XIQ_PAGE_WORKERS = 8
+# Device ids sent in one location assignment request, and requests sent at the same time
+ASSIGN_BATCH_SIZE = 100
+ASSIGN_WORKERS = 4
+# MAC addresses sent in one device filter request
+DEVICE_FILTER_CHUNK = 50
+
+# Retry policy for XIQ API calls
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+RETRY_BACKOFF = 1.0
+RETRY_MAX_BACKOFF = 60.0
+
+
+class APIError(ValueError):
+    # Raised by the API calls. status_code is None when no response was received.
+    def __init__(self, msg, status_code=None, retry_after=None):
+        super().__init__(msg)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class RetryPolicy:
+    def __init__(self, retries=5, backoff=RETRY_BACKOFF, max_backoff=RETRY_MAX_BACKOFF, status_codes=RETRY_STATUS_CODES):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.status_codes = status_codes
+
+    def shouldRetry(self, error, attempt):
+        # Connection problems and rate limit/server errors are retried, other
+        # 4xx responses will fail the same way again
+        if attempt >= self.retries:
+            return False
+        return error.status_code is None or error.status_code in self.status_codes
+
+    def delay(self, error, attempt):
+        # Retry-After from XIQ wins, otherwise exponential backoff with jitter
+        if error.retry_after is not None:
+            try:
+                return max(0.0, float(error.retry_after))
+            except ValueError:
+                try:
+                    retry_time = email.utils.parsedate_to_datetime(error.retry_after)
+                except (TypeError, ValueError):
+                    pass
+                else:
+                    return max(0.0, retry_time.timestamp() - time.time())
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        return random.uniform(delay / 2, delay)
+
 
 class XIQ:
-    def __init__(self, user_name=None, password=None, token=None):
+    def __init__(self, user_name=None, password=None, token=None, pageWorkers=XIQ_PAGE_WORKERS):
         self.URL = "https://api.extremecloudiq.com"
         self.headers = {"Accept": "application/json", "Content-Type": "application/json"}
         self.proxyDict = {
@@ -29,8 +87,16 @@ class XIQ:
             "https": ""
         }
         self.totalretries = 5
+        self.pageWorkers = pageWorkers
+        self.retryPolicy = RetryPolicy(retries=self.totalretries)
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=XIQ_POOL_SIZE)
+        self.session.mount('https://', adapter)
+        self.callStats = {}
+        self.callStatsLock = threading.Lock()
         self.locationTree_df = pd.DataFrame(columns = ['id', 'name', 'type', 'parent'])
         self.site = {}
+        self.locationTree = None
         if token:
             self.headers["Authorization"] = "Bearer " + token
         else:
@@ -49,26 +115,34 @@ class XIQ:
                 raise SystemExit 
 
     #API CALLS
-    def __setup_get_api_call(self, info, url):
-        success = 0
-        for count in range(1, self.totalretries):
+    def __retryApiCall(self, info, call, fatal=True, **kwargs):
+        # Shared retry loop for every API call. Returns the call's response, or
+        # None when it failed and fatal is False.
+        attempt = 1
+        while True:
             try:
-                response = self.__get_api_call(url=url)
-            except ValueError as e:
-                print(f"API to {info} failed attempt {count} of {self.totalretries} with {e}")
+                return call(**kwargs)
+            except APIError as e:
+                if not self.retryPolicy.shouldRetry(e, attempt):
+                    print(f"API to {info} failed attempt {attempt} of {self.totalretries} with {e}")
+                    break
+                delay = self.retryPolicy.delay(e, attempt)
+                print(f"API to {info} failed attempt {attempt} of {self.totalretries} with {e}. Retrying in {delay:.1f} seconds")
+                logger.warning(f"API to {info} failed attempt {attempt} with {e}. Retrying in {delay:.1f} seconds")
+                time.sleep(delay)
+                attempt += 1
             except Exception as e:
                 print(f"API to {info} failed with {e}")
                 print('script is exiting...')
                 raise SystemExit
-            except:
-                print(f"API to {info} failed attempt {count} of {self.totalretries} with unknown API error")
-            else:
-                success = 1
-                break
-        if success != 1:
-            print("failed to {}. Cannot continue to import".format(info))
-            print("exiting script...")
-            raise SystemExit
+        if not fatal:
+            return None
+        print("failed to {}. Cannot continue to import".format(info))
+        print("exiting script...")
+        raise SystemExit
+
+    def __setup_get_api_call(self, info, url):
+        response = self.__retryApiCall(info, self.__get_api_call, url=url)
         if 'error' in response:
             if response['error_mssage']:
                 log_msg = (f"Status Code {response['error_id']}: {response['error_message']}")
@@ -79,25 +153,7 @@ class XIQ:
         return response
         
     def __setup_post_api_call(self, info, url, payload, res=True):
-        success = 0
-        for count in range(1, self.totalretries):
-            try:
-                response = self.__post_api_call(url=url, payload=payload, res=res)
-            except ValueError as e:
-                print(f"API to {info} failed attempt {count} of {self.totalretries} with {e}")
-            except Exception as e:
-                print(f"API to {info} failed with {e}")
-                print('script is exiting...')
-                raise SystemExit
-            except:
-                print(f"API to {info} failed attempt {count} of {self.totalretries} with unknown API error")
-            else:
-                success = 1
-                break
-        if success != 1:
-            print("failed {}. Cannot continue to import".format(info))
-            print("exiting script...")
-            raise SystemExit
+        response = self.__retryApiCall(info, self.__post_api_call, url=url, payload=payload, res=res)
         if 'error' in response:
             if response['error_mssage']:
                 if 'duplicate' in response['error_message']:
@@ -111,42 +167,37 @@ class XIQ:
         return response
     
     def __setup_put_api_call(self, info, url, payload=''):
-        success = 0
-        for count in range(1, self.totalretries):
-            try:
-                if payload:
-                    self.__put_api_call(url=url, payload=payload)
-                else:
-                    self.__put_api_call(url=url)
-            except ValueError as e:
-                print(f"API to {info} failed attempt {count} of {self.totalretries} with {e}")
-            except Exception as e:
-                print(f"API to {info} failed with {e}")
-                print('script is exiting...')
-                raise SystemExit
-            except:
-                print(f"API to {info} failed attempt {count} of {self.totalretries} with unknown API error")
-            else:
-                success = 1
-                break
-        if success != 1:
-            print("failed to {}. Cannot continue to import".format(info))
-            print("exiting script...")
-            raise SystemExit
-        
+        self.__retryApiCall(info, self.__put_api_call, url=url, payload=payload)
         return 'Success'
 
 
+    def __timedRequest(self, method, url, **kwargs):
+        # All API calls go through the shared keep-alive session and are timed
+        start = time.perf_counter()
+        try:
+            return self.session.request(method, url, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.callStatsLock:
+                count, total = self.callStats.get(method, (0, 0.0))
+                self.callStats[method] = (count + 1, total + elapsed)
+
+    def apiCallStats(self):
+        lines = []
+        for method, (count, total) in sorted(self.callStats.items()):
+            lines.append(f"{method}: {count} calls, {total:.2f}s total, {total / count * 1000:.0f}ms average")
+        return "XIQ API calls - " + "; ".join(lines) if lines else "XIQ API calls - none"
+
     def __get_api_call(self, url):
         try:
-            response = requests.get(url, headers= self.headers, verify=False, proxies=self.proxyDict)
-        except HTTPError as http_err:
+            response = self.__timedRequest('GET', url, headers= self.headers, verify=False, proxies=self.proxyDict)
+        except requests.exceptions.RequestException as http_err:
             logger.error(f'HTTP error occurred: {http_err} - on API {url}')
-            raise ValueError(f'HTTP error occurred: {http_err}') 
+            raise APIError(f'HTTP error occurred: {http_err}') 
         if response is None:
             log_msg = "ERROR: No response received from XIQ!"
             logger.error(log_msg)
-            raise ValueError(log_msg)
+            raise APIError(log_msg)
         if response.status_code != 200:
             log_msg = f"Error - HTTP Status Code: {str(response.status_code)}"
             logger.error(f"{log_msg}")
@@ -157,25 +208,25 @@ class XIQ:
             else:
                 if 'error_message' in data:
                     logger.warning(f"\t\t{data['error_message']}")
-                    raise ValueError(log_msg)
-            raise ValueError(log_msg) 
+                    raise APIError(log_msg, response.status_code, response.headers.get('Retry-After'))
+            raise APIError(log_msg, response.status_code, response.headers.get('Retry-After')) 
         try:
             data = response.json()
         except json.JSONDecodeError:
             logger.error(f"Unable to parse json data - {url} - HTTP Status Code: {str(response.status_code)}")
-            raise ValueError("Unable to parse the data from json, script cannot proceed")
+            raise APIError("Unable to parse the data from json, script cannot proceed")
         return data
 
     def __post_api_call(self, url, payload, res=True):
         try:
-            response = requests.post(url, headers= self.headers, data=payload, verify=False, proxies=self.proxyDict)
-        except HTTPError as http_err:
+            response = self.__timedRequest('POST', url, headers= self.headers, data=payload, verify=False, proxies=self.proxyDict)
+        except requests.exceptions.RequestException as http_err:
             logger.error(f'HTTP error occurred: {http_err} - on API {url}')
-            raise ValueError(f'HTTP error occurred: {http_err}') 
+            raise APIError(f'HTTP error occurred: {http_err}') 
         if response is None:
             log_msg = "ERROR: No response received from XIQ!"
             logger.error(log_msg)
-            raise ValueError(log_msg)
+            raise APIError(log_msg)
         if response.status_code == 202:
             return "Success"
         elif response.status_code == 201:
@@ -192,15 +243,15 @@ class XIQ:
                     if 'duplicate' in data['error_message']:
                         return data
                     logger.warning(f"\t\t{data['error_message']}")
-                    raise Exception(data['error_message'])
-            raise ValueError(log_msg)
+                    raise APIError(data['error_message'], response.status_code, response.headers.get('Retry-After'))
+            raise APIError(log_msg, response.status_code, response.headers.get('Retry-After'))
         else:
             if res:
                 try:
                     data = response.json()
                 except json.JSONDecodeError:
                     logger.error(f"Unable to parse json data - {url} - HTTP Status Code: {str(response.status_code)}")
-                    raise ValueError("Unable to parse the data from json, script cannot proceed")
+                    raise APIError("Unable to parse the data from json, script cannot proceed")
                 return data
             else:
                 return "Success" 
@@ -208,16 +259,16 @@ class XIQ:
     def __put_api_call(self, url, payload=''):
         try:
             if payload:
-                response = requests.put(url, headers= self.headers, data=payload, verify=False, proxies=self.proxyDict)
+                response = self.__timedRequest('PUT', url, headers= self.headers, data=payload, verify=False, proxies=self.proxyDict)
             else:
-                response = requests.put(url, headers= self.headers, verify=False, proxies=self.proxyDict)
-        except HTTPError as http_err:
+                response = self.__timedRequest('PUT', url, headers= self.headers, verify=False, proxies=self.proxyDict)
+        except requests.exceptions.RequestException as http_err:
             logger.error(f'HTTP error occurred: {http_err} - on API {url}')
-            raise ValueError(f'HTTP error occurred: {http_err}') 
+            raise APIError(f'HTTP error occurred: {http_err}') 
         if response is None:
             log_msg = "ERROR: No response received from XIQ!"
             logger.error(log_msg)
-            raise ValueError(log_msg)
+            raise APIError(log_msg)
         if response.status_code != 200:
             log_msg = f"Error - HTTP Status Code: {str(response.status_code)}"
             logger.error(f"{log_msg}")
@@ -226,12 +277,12 @@ class XIQ:
                 data = response.json()
             except json.JSONDecodeError:
                 logger.error(f"Unable to parse json data - {url} - HTTP Status Code: {str(response.status_code)}")
-                raise ValueError("Unable to parse the data from json, script cannot proceed")
+                raise APIError("Unable to parse the data from json, script cannot proceed", response.status_code, response.headers.get('Retry-After'))
             else:
                 if 'error_message' in data:
                     logger.warning(f"\t\t{data['error_message']}")
-                    raise Exception(data['error_message'])
-                raise ValueError(log_msg)
+                    raise APIError(data['error_message'], response.status_code, response.headers.get('Retry-After'))
+                raise APIError(log_msg, response.status_code, response.headers.get('Retry-After'))
         else:
             return response.status_code
 
@@ -239,14 +290,14 @@ class XIQ:
         headers = self.headers.copy()
         del headers['Content-Type']
         try:
-            response = requests.post(url, headers= headers, files=files, verify=False, proxies=self.proxyDict)
-        except HTTPError as http_err:
+            response = self.__timedRequest('POST', url, headers= headers, files=files, verify=False, proxies=self.proxyDict)
+        except requests.exceptions.RequestException as http_err:
             logger.error(f'HTTP error occurred: {http_err} - on API {url}')
-            raise ValueError(f'HTTP error occurred: {http_err}') 
+            raise APIError(f'HTTP error occurred: {http_err}') 
         if response is None:
             log_msg = "ERROR: No response received from XIQ!"
             logger.error(log_msg)
-            raise ValueError(log_msg)
+            raise APIError(log_msg)
         if response.status_code != 200:
             log_msg = f"Error - HTTP Status Code: {str(response.status_code)}"
             logger.error(f"{log_msg}")
@@ -257,33 +308,15 @@ class XIQ:
             else:
                 if 'error_message' in data:
                     logger.warning(f"\t\t{data['error_message']}")
-                    raise Exception(data['error_message'])
-            raise ValueError(log_msg)
+                    raise APIError(data['error_message'], response.status_code, response.headers.get('Retry-After'))
+            raise APIError(log_msg, response.status_code, response.headers.get('Retry-After'))
         return 1
 
     def __getAccessToken(self, user_name, password):
         info = "get XIQ token"
-        success = 0
         url = self.URL + "/login"
         payload = json.dumps({"username": user_name, "password": password})
-        for count in range(1, self.totalretries):
-            try:
-                data = self.__post_api_call(url=url,payload=payload)
-            except ValueError as e:
-                print(f"API to {info} failed attempt {count} of {self.totalretries} with {e}")
-            except Exception as e:
-                print(f"API to {info} failed with {e}")
-                print('script is exiting...')
-                raise SystemExit
-            except:
-                print(f"API to {info} failed attempt {count} of {self.totalretries} with unknown API error")
-            else:
-                success = 1
-                break
-        if success != 1:
-            print("failed to get XIQ token. Cannot continue to import")
-            print("exiting script...")
-            raise SystemExit
+        data = self.__retryApiCall(info, self.__post_api_call, url=url, payload=payload)
         
         if "access_token" in data:
             #print("Logged in and Got access token: " + data["access_token"])
@@ -295,22 +328,54 @@ class XIQ:
             logger.warning(log_msg)
             raise ValueError(log_msg)
     
+    # PAGINATION
+    def __getPage(self, info, url, page, pageSize):
+        sep = '&' if '?' in url else '?'
+        return self.__setup_get_api_call(info, f"{url}{sep}page={page}&limit={pageSize}")
+
+    def __gatherPages(self, info, url, pageSize, label):
+        # The first page gives the total number of pages, the remaining pages
+        # are then fetched concurrently. Results are returned in page order.
+        rawList = self.__getPage(info, url, 1, pageSize)
+        pageCount = rawList['total_pages']
+        print(f"completed page 1 of {pageCount} collecting {label}")
+        results = list(rawList['data'])
+        if pageCount <= 1:
+            return results
+        with ThreadPoolExecutor(max_workers=self.pageWorkers) as executor:
+            futures = [executor.submit(self.__getPage, info, url, page, pageSize) for page in range(2, pageCount + 1)]
+            for future in futures:
+                rawList = future.result()
+                results.extend(rawList['data'])
+                print(f"completed page {rawList['page']} of {pageCount} collecting {label}")
+        return results
+
+    def __iterPages(self, info, url, pageSize, label):
+        # Yields the data of one page at a time. Up to pageWorkers of the following
+        # pages are requested in the background while the caller works on the
+        # current one, so only those pages are held in memory.
+        rawList = self.__getPage(info, url, 1, pageSize)
+        pageCount = rawList['total_pages']
+        print(f"completed page 1 of {pageCount} collecting {label}")
+        with ThreadPoolExecutor(max_workers=self.pageWorkers) as executor:
+            pending = collections.deque()
+            nextPage = 2
+            while True:
+                while nextPage <= pageCount and len(pending) < self.pageWorkers:
+                    pending.append(executor.submit(self.__getPage, info, url, nextPage, pageSize))
+                    nextPage += 1
+                yield rawList['data']
+                if not pending:
+                    break
+                rawList = pending.popleft().result()
+                print(f"completed page {rawList['page']} of {pageCount} collecting {label}")
+
     # EXTERNAL ACCOUNTS
     def __getVIQInfo(self):
         info="get current VIQ name"
-        success = 0
         url = "{}/account/home".format(self.URL)
-        for count in range(1, self.totalretries):
-            try:
-                data = self.__get_api_call(url=url)
-            except ValueError as e:
-                print(f"API to {info} failed attempt {count} of {self.totalretries} with {e}")
-            except:
-                print(f"API to {info} failed attempt {count} of {self.totalretries} with unknown API error")
-            else:
-                success = 1
-                break
-        if success != 1:
+        data = self.__retryApiCall(info, self.__get_api_call, fatal=False, url=url)
+        if data is None:
             print(f"Failed to {info}")
             return 1
             
@@ -324,19 +389,9 @@ class XIQ:
     def selectManagedAccount(self):
         self.__getVIQInfo()
         info="gather accessible external XIQ accounts"
-        success = 0
         url = "{}/account/external".format(self.URL)
-        for count in range(1, self.totalretries):
-            try:
-                data = self.__get_api_call(url=url)
-            except ValueError as e:
-                print(f"API to {info} failed attempt {count} of {self.totalretries} with {e}")
-            except:
-                print(f"API to {info} failed attempt {count} of {self.totalretries} with unknown API error")
-            else:
-                success = 1
-                break
-        if success != 1:
+        data = self.__retryApiCall(info, self.__get_api_call, fatal=False, url=url)
+        if data is None:
             print(f"Failed to {info}")
             return 1
             
@@ -346,31 +401,14 @@ class XIQ:
 
     def switchAccount(self, viqID, viqName):
         info=f"switch to external account {viqName}"
-        success = 0
         url = "{}/account/:switch?id={}".format(self.URL,viqID)
         payload = ''
-        for count in range(1, self.totalretries):
-            try:
-                data = self.__post_api_call(url=url, payload=payload)
-            except ValueError as e:
-                print(f"API to {info} failed attempt {count} of {self.totalretries} with {e}")
-            except Exception as e:
-                print(f"API to {info} failed with {e}")
-                print('script is exiting...')
-                raise SystemExit
-            except:
-                print(f"API to {info} failed attempt {count} of {self.totalretries} with unknown API error")
-            else:
-                success = 1
-                break
-        if success != 1:
-            print("failed to get XIQ token to {}. Cannot continue to import".format(info))
-            print("exiting script...")
-            raise SystemExit
+        data = self.__retryApiCall(info, self.__post_api_call, url=url, payload=payload)
         
         if "access_token" in data:
             #print("Logged in and Got access token: " + data["access_token"])
             self.headers["Authorization"] = "Bearer " + data["access_token"]
+            self.locationTree = None
             self.__getVIQInfo()
             if viqName != self.viqName:
                 logger.error(f"Failed to switch external accounts. Script attempted to switch to {viqName} but is still in {self.viqName}")
@@ -387,17 +425,39 @@ class XIQ:
 
     # LOCATIONS
 
-    def gatherLocations(self):
-        info=f"gather global location"
-        url = "{}/locations/tree?expandChildren=false".format(self.URL)
-        response = self.__setup_get_api_call(info,url)
-        for location in response:
-            global_id = location['id']
-            url = "{}/locations/tree?parentId={}&expandChildren=false".format(self.URL,global_id)
-            child_response = self.__setup_get_api_call(info,url)
-            location['children'] = child_response
-        return response
-    
+    def gatherLocationTree(self, walk=False):
+        # The whole location tree with every level of children, fetched once and
+        # cached for the run. It is requested with expandChildren in one call,
+        # or walked level by level when walk is set or the single call fails.
+        if self.locationTree is None:
+            tree = None
+            if not walk:
+                info = "gather location tree"
+                url = "{}/locations/tree?expandChildren=true".format(self.URL)
+                tree = self.__retryApiCall(info, self.__get_api_call, fatal=False, url=url)
+                if tree is None:
+                    log_msg = "Failed to gather the full location tree in one request, collecting it level by level"
+                    logger.warning(log_msg)
+                    print(log_msg)
+            if tree is None:
+                tree = self.__walkLocationTree()
+            self.locationTree = tree
+        return self.locationTree
+
+    def __walkLocationTree(self):
+        # breadth first, the children of every location on a level are fetched concurrently
+        tree = self.__setup_get_api_call("gather global location", "{}/locations/tree?expandChildren=false".format(self.URL))
+        level = tree
+        with ThreadPoolExecutor(max_workers=self.pageWorkers) as executor:
+            while level:
+                parents = [location for location in level if location['type'] != 'FLOOR']
+                for location in level:
+                    location['children'] = []
+                for location, children in zip(parents, executor.map(lambda location: self.gatherChildren(location['id']), parents)):
+                    location['children'] = children
+                level = [child for location in parents for child in location['children']]
+        return tree
+
     def gatherChildren(self, loc_id):
         info=f"gather global location"
         url = "{}/locations/tree?parentId={}&expandChildren=false".format(self.URL,loc_id)
@@ -468,24 +528,16 @@ class XIQ:
             response = self.__setup_put_api_call(info, url, payload=payload)
             return site_id
 
+    def gatherExistingSites(self, pageSize):
+        info = "collecting sites"
+        url = f"{self.URL}/locations/site?order=ASC"
+        return self.__gatherPages(info, url, pageSize, "sites")
+
     #BUILDINGS
     def gatherExistingBuildings(self,pageSize):
         info = "collecting buildings"
-        page = 1
-        pageCount = 1
-        firstCall = True
-        
-        buildings = []
-        while page <= pageCount:
-            url = f"{self.URL}/locations/building?page={page}&limit={pageSize}&order=ASC"
-            rawList = self.__setup_get_api_call(info,url)
-            buildings = buildings + rawList['data']
-
-            if firstCall == True:
-                pageCount = rawList['total_pages']
-            print(f"completed page {page} of {rawList['total_pages']} collecting buildings")
-            page = rawList['page'] + 1
-        return buildings
+        url = f"{self.URL}/locations/building?order=ASC"
+        return self.__gatherPages(info, url, pageSize, "buildings")
     
     def checkBuilding(self, name):
         building_id = 0
@@ -518,51 +570,19 @@ class XIQ:
     #FLOORS
     def gatherExistingFloors(self, pageSize):
         info = "collecting floors"
-        page = 1
-        pageCount = 1
-        firstCall = True
-        
-        floors = []
-        while page <= pageCount:
-            url = f"{self.URL}/locations/floor?page={page}&limit={pageSize}&order=ASC"
-            rawList = self.__setup_get_api_call(info,url)
-            floors = floors + rawList['data']
-
-            if firstCall == True:
-                pageCount = rawList['total_pages']
-            print(f"completed page {page} of {rawList['total_pages']} collecting floors")
-            page = rawList['page'] + 1
-        return floors
+        url = f"{self.URL}/locations/floor?order=ASC"
+        return self.__gatherPages(info, url, pageSize, "floors")
 
     def uploadFloorplan(self, filename):
         info=f"upload {filename}"
-        success = 0
         url = "{}/locations/floorplan".format(self.URL)
         filepathname = PATH + f"/images/{filename}"
         files={
             'file' : (f'{filename}', open(filepathname, 'rb'), 'image/png'),
             'type': 'image/png'
         }
-        for count in range(1, self.totalretries):
-            try:
-                self.__image_api_call(url=url, files=files)
-            except ValueError as e:
-                print(f"\nAPI to {info} failed attempt {count} of {self.totalretries} with {e}")
-            except Exception as e:
-                print(f"\nAPI to {info} failed with {e}")
-                print('script is exiting...')
-                raise SystemExit
-            except:
-                print(f"\nAPI to {info} failed attempt {count} of {self.totalretries} with unknown API error")
-            else:
-                success = 1
-                break
-        if success != 1:
-            print("\nfailed to {}. Cannot continue to import".format(info))
-            print("exiting script...")
-            raise SystemExit
-        else:
-            logger.info(f"Successfully uploaded {filename}")
+        self.__retryApiCall(info, self.__image_api_call, url=url, files=files)
+        logger.info(f"Successfully uploaded {filename}")
 
     def getFloorsOfBuilding(self, rfd_name):
         floors = {}
@@ -635,22 +655,32 @@ class XIQ:
     #APS
     def collectDevices(self, pageSize):
         info = "collecting devices" 
-        page = 1
-        pageCount = 1
-        firstCall = True
+        url = self.URL + "/devices?nullField=LOCATION_ID&order=ASC"
+        return self.__gatherPages(info, url, pageSize, "Devices")
 
+    def iterDevices(self, pageSize):
+        # same devices as collectDevices, yielded a page at a time
+        info = "collecting devices" 
+        url = self.URL + "/devices?nullField=LOCATION_ID&order=ASC"
+        return self.__iterPages(info, url, pageSize, "Devices")
+    
+    def collectDevicesByMac(self, macs, pageSize, chunkSize=DEVICE_FILTER_CHUNK):
+        # Unlocated devices with one of the given MAC addresses. The MACs are sent
+        # chunkSize at a time as macAddresses filters, the chunks are requested
+        # concurrently. The devices are returned sorted by id, like collectDevices.
+        chunks = [macs[start:start + chunkSize] for start in range(0, len(macs), chunkSize)]
+        def collectChunk(chunk_number):
+            chunk = chunks[chunk_number]
+            info = f"collecting devices by MAC address ({len(chunk)} MACs)"
+            url = self.URL + "/devices?nullField=LOCATION_ID&order=ASC&" + "&".join(f"macAddresses={mac}" for mac in chunk)
+            return self.__gatherPages(info, url, pageSize, f"Devices for MAC chunk {chunk_number + 1} of {len(chunks)}")
         devices = []
-        while page <= pageCount:
-            url = self.URL + "/devices?page=" + str(page) + "&limit=" + str(pageSize) + "&nullField=LOCATION_ID&order=ASC"
-            rawList = self.__setup_get_api_call(info,url)
-            devices = devices + rawList['data']
-
-            if firstCall == True:
-                pageCount = rawList['total_pages']
-            print(f"completed page {page} of {rawList['total_pages']} collecting Devices")
-            page = rawList['page'] + 1 
+        with ThreadPoolExecutor(max_workers=self.pageWorkers) as executor:
+            for chunk_devices in executor.map(collectChunk, range(len(chunks))):
+                devices.extend(chunk_devices)
+        devices.sort(key=lambda device: device['id'])
         return devices
-    
+
     def changeAPLocation(self, data):
         info="set location for APs " 
         payload = json.dumps(data)
@@ -658,21 +688,33 @@ class XIQ:
         response = self.__setup_post_api_call(info,url,payload=payload, res=False)
         return response
 
+    def assignDeviceLocations(self, assignments, batchSize=ASSIGN_BATCH_SIZE, workers=ASSIGN_WORKERS):
+        # assignments maps a name (rf-domain) to a changeAPLocation payload. The device
+        # ids are sent in batches of at most batchSize, several batches at a time.
+        # Each batch is retried on its own and a batch that still fails doesn't stop
+        # the others. Returns one result per batch in the order they were split.
+        batches = []
+        for name, data in assignments.items():
+            ids = data['devices']['ids']
+            for start in range(0, len(ids), batchSize):
+                batch = dict(data, devices={'ids': ids[start:start + batchSize]})
+                batches.append((name, batch))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(lambda batch: self.__assignBatch(*batch), batches))
+
+    def __assignBatch(self, name, data):
+        ids = data['devices']['ids']
+        info = f"set location for {len(ids)} APs in {name}"
+        url = f"{self.URL}/devices/location/:assign"
+        start = time.perf_counter()
+        response = self.__retryApiCall(info, self.__post_api_call, fatal=False, url=url, payload=json.dumps(data), res=False)
+        elapsed = time.perf_counter() - start
+        if response is None:
+            logger.error(f"Failed to {info} - device ids {ids}")
+        return {'name': name, 'ids': ids, 'success': response is not None, 'seconds': elapsed}
+
     ## CCG
     def collectCCG(self,pageSize):
         info = "collecting CCGs" 
-        page = 1
-        pageCount = 1
-        firstCall = True
-
-        ccg_info = []
-        while page <= pageCount:
-            url = self.URL + "/ccgs?page=" + str(page) + "&limit=" + str(pageSize)
-            rawList = self.__setup_get_api_call(info,url)
-            ccg_info = ccg_info + rawList['data']
-
-            if firstCall == True:
-                pageCount = rawList['total_pages']
-            print(f"completed page {page} of {rawList['total_pages']} collecting ccg_info")
-            page = rawList['page'] + 1 
-        return ccg_info
+        url = self.URL + "/ccgs"
+        return self.__gatherPages(info, url, pageSize, "ccg_info")
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# Times parsing one AP config block with a TextFSM template compiled for every AP,
+# against the compiled template cached by Wing.getTemplate.
+#   python bench/ap_parse.py --runs 3000
+import argparse
+import os
+import sys
+import timeit
+import textfsm
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.insert(0, parent_dir)
+from app.Wing_importer import Wing, PATH
+
+TEMPLATE = 'wing_apconfig.textfsm'
+
+AP_BLOCK = """ap7532 84-24-8D-81-5E-6C
+ use profile default-ap7532
+ use rf-domain DOM1
+ hostname ap-1
+ floor "Floor 2"
+ interface radio1
+  shutdown
+ interface ge1
+  switchport mode access
+!
+"""
+
+
+def compileEveryAp():
+    # What the AP loop did before the templates were cached
+    with open(f'{PATH}/templates/{TEMPLATE}') as f:
+        template = textfsm.TextFSM(f)
+    return template.ParseText(AP_BLOCK)
+
+
+def cachedTemplate():
+    return Wing.getTemplate(TEMPLATE).ParseText(AP_BLOCK)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=3000, help="AP blocks parsed by each variant")
+    args = parser.parse_args()
+
+    if compileEveryAp() != cachedTemplate():
+        raise SystemExit("The cached template parsed the AP block differently")
+    for label, parse in [("compile per AP", compileEveryAp), ("cached template", cachedTemplate)]:
+        seconds = min(timeit.repeat(parse, number=args.runs, repeat=3))
+        print(f"{label}: {seconds / args.runs * 1e6:.0f} us per AP")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# Times the AP floor reconciliation stage of Wing.exportFile on a synthetic tech
+# dump, against the per-AP DataFrame lookup it replaced.
+#   python bench/floor_reconcile.py --aps 10000 --domains 1000
+import argparse
+import copy
+import io
+import logging
+import os
+import random
+import sys
+import tarfile
+import tempfile
+import time
+import pandas as pd
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.insert(0, parent_dir)
+from app.Wing_importer import Wing
+
+AP_MODELS = ['ap7532', 'ap7632', 'ap8533']
+
+
+def makeTechDump(path, aps, domains, seed=1):
+    # Tech dump with the two members the importer reads. A third of the rf-domains
+    # have no floors and a quarter of the APs are set to a floor the rf-domain doesn't have.
+    r = random.Random(seed)
+    domain_names = [f"DOM{i}" for i in range(domains)]
+    managers = "\n" * 4 + "".join(f"{i+1}   {name}   controller\n" for i, name in enumerate(domain_names)) + "\n\n"
+    config = ["!\nversion 5.9\n!\n"]
+    for i, name in enumerate(domain_names):
+        lines = [f"rf-domain {name}", " country-code us", f' tree-node country "USA" city "City{i % 50}" campus "Campus{i}"']
+        for f in range(i % 3):
+            lines.append(f" layout area A{f} floor Floor{f} {f+1}")
+        config.append("\n".join(lines) + "\n!\n")
+    for a in range(aps):
+        mac = "-".join(f"{r.randrange(256):02X}" for _ in range(6))
+        lines = [f"{r.choice(AP_MODELS)} {mac}", f" hostname ap-{a}", f" use rf-domain {r.choice(domain_names)}"]
+        if r.randrange(4) == 0:
+            lines.append(f" floor Floor{r.randrange(4)}")
+        config.append("\n".join(lines) + "\n!\n")
+    config.append("end\n")
+    with tarfile.open(path, "w:gz") as tar:
+        for member_name, text in [("output/cli.show_global_domain_managers", managers),
+                                  ("files/etc2/nvram/startup-config", "".join(config))]:
+            raw = text.encode()
+            info = tarfile.TarInfo(member_name)
+            info.size = len(raw)
+            tar.addfile(info, io.BytesIO(raw))
+
+
+def baselineReconcile(data, ap_data):
+    # The reconciliation before the rf-domain floors were kept in a dict, every AP
+    # filtered the rf-domain DataFrame and searched the floor list
+    domain_df = pd.DataFrame(data)
+    for ap in ap_data:
+        filt = domain_df['name'] == ap['rfdomain']
+        floorList = domain_df.loc[filt, 'floors'].values[0]
+        if not isinstance(floorList, list):
+            floorList = []
+        if ap['floor']:
+            if ap['floor'] not in floorList:
+                floorList.append(ap['floor'])
+        elif floorList:
+            ap['floor'] = floorList[0]
+        else:
+            ap['floor'] = 'floor1'
+            floorList.append(ap['floor'])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--aps', type=int, default=10000, help="APs in the synthetic startup-config")
+    parser.add_argument('--domains', type=int, default=1000, help="rf-domains in the synthetic startup-config")
+    args = parser.parse_args()
+
+    # warnings for every added floor would time the log file instead of the stage
+    logging.getLogger('MapImporter').setLevel(logging.ERROR)
+
+    stage = {}
+    reconcileFloors = Wing.reconcileFloors
+
+    def timedReconcile(self, data, ap_data):
+        stage['inputs'] = copy.deepcopy((data, ap_data))
+        start = time.perf_counter()
+        reconcileFloors(self, data, ap_data)
+        stage['seconds'] = time.perf_counter() - start
+
+    Wing.reconcileFloors = timedReconcile
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, 'tech_dump.tar.gz')
+        makeTechDump(filename, args.aps, args.domains)
+        start = time.perf_counter()
+        Wing(filename, APNoFloorLogging=False, GEOAPILogging=False).exportFile()
+        export_seconds = time.perf_counter() - start
+
+    data, ap_data = stage['inputs']
+    start = time.perf_counter()
+    baselineReconcile(data, ap_data)
+    baseline_seconds = time.perf_counter() - start
+
+    print(f"{len(ap_data)} APs in {len(data)} rf-domains, exportFile took {export_seconds:.2f}s")
+    print(f"floor reconciliation: {stage['seconds'] * 1000:.1f} ms")
+    print(f"per-AP DataFrame lookup: {baseline_seconds * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()